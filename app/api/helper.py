@@ -1,15 +1,107 @@
 import os
+import time
+from types import MappingProxyType
 
 from flask import jsonify
 
-from app.models import Message, User, GroupRole, RolePermission
+from app.cache import TTLCache
+from app.extensions import db
+from app.models import Message, User, GroupRole, RolePermission, Permission, Question
+from app.schema_validator import FrequentQuestionSchema, QuestionSchema
 from app.settings import ProdConfig, DevConfig
+from app.similarity import faq_matcher, question_duplicate_index
 
 # call config service
 
 
 CONFIG = DevConfig if os.environ.get('FLASK_DEBUG') == '1' else ProdConfig
 
+# group_id -> frozenset of permission resources
+group_permission_cache = TTLCache(max_size=256, ttl=CONFIG.PERMISSION_CACHE_TTL)
+
+
+def get_group_permissions(group_id: str) -> frozenset:
+    """
+    get all permission resources of a group, cached per group_id
+    Args:
+        group_id:
+
+    Returns:
+        permissions: frozenset of resource like "get@/api/v1/admin/users"
+    """
+    permissions = group_permission_cache.get(group_id)
+    if permissions is None:
+        rows = db.session.query(Permission.resource) \
+            .join(RolePermission, RolePermission.permission_id == Permission.id) \
+            .join(GroupRole, GroupRole.role_id == RolePermission.role_id) \
+            .filter(GroupRole.group_id == group_id) \
+            .distinct().all()
+        permissions = frozenset(row.resource for row in rows)
+        group_permission_cache.set(group_id, permissions)
+    return permissions
+
+
+def invalidate_group_permissions(group_id: str = None):
+    """
+    drop cached permissions of a group, or of every group when group_id is None
+    (a role can be shared by many groups)
+    Args:
+        group_id:
+    """
+    if group_id is None:
+        group_permission_cache.clear()
+    else:
+        group_permission_cache.delete(group_id)
+
+
+class MessageCatalog(object):
+    """
+    Read only copy of the message table, used to fill the envelope of send_result/send_error
+    without any database round trip. It is loaded when the app starts and replaced as a whole by reload().
+    """
+
+    def __init__(self):
+        self._messages = MappingProxyType({})
+        self.loaded_at = None
+
+    def reload(self) -> int:
+        """
+        Load the message table, requires an app context
+        Returns:
+            number of messages
+        """
+        rows = db.session.query(Message.id, Message.message, Message.status, Message.show, Message.duration).all()
+        self._messages = MappingProxyType({
+            str(row.id): MappingProxyType({
+                "text": row.message,
+                "status": row.status,
+                "show": row.show,
+                "duration": row.duration
+            }) for row in rows
+        })
+        self.loaded_at = time.time()
+        return len(self._messages)
+
+    def get(self, message_id):
+        return self._messages.get(str(message_id))
+
+
+message_catalog = MessageCatalog()
+
+
+def _build_message(message_id, message, status, show, duration) -> dict:
+    message_dict = {
+        "id": message_id,
+        "text": message,
+        "status": status,
+        "show": show,
+        "duration": duration,
+    }
+    message_obj = message_catalog.get(message_id)
+    if message_obj:
+        message_dict.update(message_obj)
+    return message_dict
+
 
 def get_permissions(user: User):
     """
@@ -20,16 +112,36 @@ def get_permissions(user: User):
     Returns:
         permissions:
     """
-    permissions = []
-    group_id = user.group_id
-    list_role = GroupRole.query.filter(GroupRole.group_id == group_id).all()
-    for group_role in list_role:
-        list_permission = RolePermission.query.filter(RolePermission.role_id == group_role.role_id).all()
-        for role_permission in list_permission:
-            if role_permission.permission.resource not in permissions:
-                permissions.append(role_permission.permission.resource)
+    return sorted(get_group_permissions(user.group_id))
 
-    return permissions
+
+def dump_frequent_questions(question: Question) -> list:
+    """
+    frequently asked questions which may already answer a new question
+    Args:
+        question:
+
+    Returns:
+        [{id, question, answer, score}], best first
+    """
+    schema = FrequentQuestionSchema(only=['id', 'question', 'answer'])
+    return [dict(schema.dump(frequent_question), score=score)
+            for frequent_question, score in faq_matcher.match_question(question)]
+
+
+def dump_duplicate_questions(question: Question) -> list:
+    """
+    near-duplicates of a question already asked, so staff can handle them as one thread.
+    Any question of the system can match, only return them to staff
+    Args:
+        question:
+
+    Returns:
+        [{id, title, status, created_date, score}], best first
+    """
+    schema = QuestionSchema(only=['id', 'title', 'status', 'created_date'])
+    return [dict(schema.dump(duplicate), score=score)
+            for duplicate, score in question_duplicate_index.find_duplicates(question)]
 
 
 def send_result(data: any = None, message_id: str = '', message: str = "OK", code: int = 200,
@@ -50,19 +162,7 @@ def send_result(data: any = None, message_id: str = '', message: str = "OK", cod
     :return:
     json rendered sting result
     """
-    message_dict = {
-        "id": message_id,
-        "text": message,
-        "status": status,
-        "show": show,
-        "duration": duration,
-    }
-    message_obj: Message = Message.query.get(message_id)
-    if message_obj:
-        message_dict['text'] = message_obj.message
-        message_dict['status'] = message_obj.status
-        message_dict['show'] = message_obj.show
-        message_dict['duration'] = message_obj.duration
+    message_dict = _build_message(message_id, message, status, show, duration)
 
     res = {
         "code": code,
@@ -87,19 +187,7 @@ def send_error(data: any = None, message_id: str = '', message: str = "Error", c
     :param duration:
     :return:
     """
-    message_dict = {
-        "id": message_id,
-        "text": message,
-        "status": status,
-        "show": show,
-        "duration": duration,
-    }
-    message_obj = Message.query.get(message_id)
-    if message_obj:
-        message_dict['text'] = message_obj.message
-        message_dict['status'] = message_obj.status
-        message_dict['show'] = message_obj.show
-        message_dict['duration'] = message_obj.duration
+    message_dict = _build_message(message_id, message, status, show, duration)
 
     res = {
         "code": code,
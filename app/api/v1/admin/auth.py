@@ -1,21 +1,19 @@
-import json
 from datetime import timedelta
 
-import requests as requests
 from flask import Blueprint, request
-from werkzeug.security import generate_password_hash, check_password_hash
 
-from app.extensions import jwt, logger, db
-from app.api.helper import send_error, send_result, get_permissions
+from app.extensions import jwt, logger, db, password_hasher
+from app.api.helper import send_error, send_result
 from flask_jwt_extended import (
     jwt_required, create_access_token,
     jwt_refresh_token_required, get_jwt_identity,
-    create_refresh_token, get_raw_jwt)
+    create_refresh_token, get_raw_jwt, get_jwt_claims)
 from app.models import User, Token
-from app.schema_validator import LoginValidation, ChangePasswordValidator, UserSchema
+from app.schema_validator import LoginValidation, ChangePasswordValidator, UserSchema, get_validator
 from sqlalchemy import or_
 from app.enums import SUCCESS, FAIL, LOGIN_WRONG_USERNAME, LOGIN_WRONG_PASSWORD
-import requests
+from app.gateway import build_permission_claims
+from app.security import PasswordPoolBusy
 
 ACCESS_EXPIRES = timedelta(days=30)
 REFRESH_EXPIRES = timedelta(days=90)
@@ -39,7 +37,7 @@ def login():
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = LoginValidation()
+    validator_input = get_validator(LoginValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -49,8 +47,17 @@ def login():
     user = User.query.filter(or_(User.username == username, User.email == username)).first()
     if user is None:
         return send_error(message_id=LOGIN_WRONG_USERNAME)
-    if check_password_hash(generate_password_hash(password), user.password) is False:
+    try:
+        is_valid, new_password_hash = password_hasher.check_user_password(user, password)
+    except PasswordPoolBusy:
+        return send_error(message="Server is busy, please try again later", code=503)
+    if not is_valid:
         return send_error(message_id=LOGIN_WRONG_PASSWORD)
+    if new_password_hash:
+        # upgrade the stored hash to the configured method and cost
+        user.password_hash = new_password_hash
+        db.session.add(user)
+        db.session.commit()
     # get info user
     user_id = user.id
     first_name = user.first_name
@@ -58,14 +65,12 @@ def login():
     email = user.email
     username = user.username
     group_id = user.group_id
-    site_map = requests.get("http://localhost:5000/api/v1/helper/site-map")
-    data = json.loads(site_map.content.decode("UTF-8")).get("data")
-    # list_permission = get_permissions(user)
-    list_permission = json.loads(site_map.content.decode("UTF-8")).get("data")
+    user_claims = build_permission_claims(group_id)
+    user_claims["token_epoch"] = user.token_epoch
     access_token = create_access_token(identity=str(user.id), expires_delta=ACCESS_EXPIRES,
-                                       user_claims={"list_permission": list_permission})
+                                       user_claims=user_claims)
     refresh_token = create_refresh_token(identity=str(user.id), expires_delta=REFRESH_EXPIRES,
-                                         user_claims={"list_permission": list_permission})
+                                         user_claims=user_claims)
     # access_token = create_access_token(identity=str(user_id), expires_delta=ACCESS_EXPIRES)
     # refresh_token = create_refresh_token(identity=str(user_id), expires_delta=REFRESH_EXPIRES)
     Token.add_token_to_database(access_token, user.id)
@@ -102,23 +107,27 @@ def change_password():
     try:
         json_body = request.get_json()
         current_user_id = get_jwt_identity()
-        jti = get_raw_jwt()['jti']
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = ChangePasswordValidator()
+    validator_input = get_validator(ChangePasswordValidator)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
     # create user
     user = User.get_by_id(current_user_id)
-    if generate_password_hash(json_body["old_password"]) == user.password_hash:
-        return send_error(message_id=FAIL)
+    try:
+        is_valid, _ = password_hasher.check_user_password(user, json_body["old_password"])
+        if not is_valid:
+            return send_error(message_id=FAIL)
+        user.password_hash = password_hasher.hash(json_body["new_password"])
+    except PasswordPoolBusy:
+        return send_error(message="Server is busy, please try again later", code=503)
     user.password = json_body["new_password"]
-    user.password_hash = generate_password_hash(json_body["new_password"])
     db.session.add(user)
     db.session.commit()
-    Token.revoke_token(jti)
+    # the sessions opened with the old password end with the current one
+    Token.revoke_all_token(current_user_id)
     return send_result(message_id=SUCCESS, data=UserSchema().dump(user))
 
 
@@ -130,8 +139,14 @@ def refresh():
     :return:
     """
     current_user_id = get_jwt_identity()
-    access_token = create_access_token(identity=current_user_id, expires_delta=ACCESS_EXPIRES)
-    refresh_token = create_refresh_token(identity=current_user_id, expires_delta=REFRESH_EXPIRES)
+    # keep the claims (token_epoch, ...) of the refresh token, with up to date permissions
+    user_claims = dict(get_jwt_claims())
+    if "group_id" in user_claims:
+        user_claims.update(build_permission_claims(user_claims["group_id"]))
+    access_token = create_access_token(identity=current_user_id, expires_delta=ACCESS_EXPIRES,
+                                       user_claims=user_claims)
+    refresh_token = create_refresh_token(identity=current_user_id, expires_delta=REFRESH_EXPIRES,
+                                         user_claims=user_claims)
     Token.add_token_to_database(access_token, current_user_id)
     Token.add_token_to_database(refresh_token, current_user_id)
     data = {
@@ -160,7 +175,7 @@ def logout():
 # check token revoked_store
 @jwt.token_in_blacklist_loader
 def check_if_token_is_revoked(decrypted_token):
-    return Token.is_token_revoked(decrypted_token)
+    return Token.is_token_revoked(decrypted_token) or Token.is_token_epoch_stale(decrypted_token)
 # # Endpoint for revoking the current users refresh token
 # @api.route('/logout2', methods=['DELETE'])
 # @jwt_refresh_token_required
@@ -1,22 +1,21 @@
-import urllib
 import uuid
 
 from flask import Blueprint, request
 from flask_jwt_extended import get_jwt_identity
 from marshmallow import ValidationError
-from sqlalchemy import or_, asc, desc, and_
-from sqlalchemy_pagination import paginate
 from app.api.helper import send_error, send_result
 from app.enums import FAIL, SUCCESS
 from app.extensions import db
+from app.list_query import ListQuery
 from app.gateway import authorization_require
 from app.schema_validator import GroupSchema, FormSchema, UpdateFormValidation, \
-    CreateFormValidation, GetFormValidation
+    CreateFormValidation, GetFormValidation, get_validator
 from app.models import User, Group, Form
 
-from app.utils import escape_wildcard, get_timestamp_now
 
 api = Blueprint('admin/forms', __name__)
+form_list = ListQuery('forms', Form, search_columns=[Form.name, Form.description],
+                      sort_columns=['name', 'created_date', 'modified_date'], date_column=None)
 
 
 @api.route('', methods=['GET'])
@@ -29,45 +28,24 @@ def get_forms():
     # 1. validate request parameters
     try:
         params = request.args
-        params = GetFormValidation().load(params) if params else dict()
+        params = get_validator(GetFormValidation).load(params) if params else dict()
     except ValidationError as err:
         return send_error(message_id=FAIL, data=err.messages)
 
-    # 2. Process input
-    page_number = params.get('page', 1)
-    page_size = params.get('page_size', 15)
-    search_name = params.get('search_name', '')
-    search_name = urllib.parse.unquote(search_name, encoding='utf-8', errors='replace').strip()
-    search_name = escape_wildcard(search_name)
-    sort_by = params.get('sort_by', None)
-    order_by = params.get('order_by', 'desc')
-
-    # 3. Query
-    query = Form.query
-    if len(search_name):
-        query = query.filter(
-            or_(Form.name.like("%{}%".format(search_name)),
-                Form.description.like("%{}%".format(search_name))))
-    # 4. Sort by collum
-    if sort_by:
-        column_sorted = getattr(Form, sort_by)
-        if order_by == 'asc':
-            query = query.order_by(asc(column_sorted))
-        else:
-            query = query.order_by(desc(column_sorted))
-    # Default: sort by created date
-    else:
-        query = query.order_by(Form.created_date.desc())
-
-    # 5. Paginator
-    paginator = paginate(query, page_number, page_size)
-    # 6. Dump data
+    # 2. Query
+    try:
+        paginator = form_list.execute(params)
+    except ValidationError as err:
+        return send_error(message_id=FAIL, data=err.messages)
+    # 3. Dump data
     forms = FormSchema(many=True).dump(paginator.items)
     response_data = dict(
         forms=forms,
         total_pages=paginator.pages,
         total=paginator.total
     )
+    if params.get('cursor') is not None:
+        response_data['next_cursor'] = paginator.next_cursor
     return send_result(data=response_data)
 
 
@@ -88,7 +66,7 @@ def create_form():
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = CreateFormValidation()
+    validator_input = get_validator(CreateFormValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -128,7 +106,7 @@ def update_form(form_id: str):
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = UpdateFormValidation()
+    validator_input = get_validator(UpdateFormValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -1,22 +1,22 @@
-import urllib
 import uuid
 
 from flask import Blueprint, request
 from flask_jwt_extended import get_jwt_identity
 from marshmallow import ValidationError
-from sqlalchemy import asc, desc, and_
-from sqlalchemy_pagination import paginate
 from app.api.helper import send_error, send_result
 from app.enums import FAIL, SUCCESS
 from app.extensions import db
+from app.list_query import ListQuery
+from app.similarity import faq_matcher
 from app.gateway import authorization_require
 from app.schema_validator import FrequentQuestionSchema, UpdateFrequentQuestionValidation, \
-    CreateFrequentQuestionValidation, GetFrequentQuestionValidation
+    CreateFrequentQuestionValidation, GetFrequentQuestionValidation, get_validator
 from app.models import User, FrequentQuestion
 
-from app.utils import escape_wildcard, get_timestamp_now
 
 api = Blueprint('admin/frequent_questions', __name__)
+frequent_question_list = ListQuery('frequent_questions', FrequentQuestion, search_columns=[FrequentQuestion.question],
+                                   sort_columns=['question', 'answer', 'created_date', 'modified_date'])
 
 
 @api.route('', methods=['GET'])
@@ -29,46 +29,24 @@ def get_frequent_questions():
     # 1. validate request parameters
     try:
         params = request.args
-        params = GetFrequentQuestionValidation().load(params) if params else dict()
+        params = get_validator(GetFrequentQuestionValidation).load(params) if params else dict()
     except ValidationError as err:
         return send_error(message_id=FAIL, data=err.messages)
 
-    # 2. Process input
-    page_number = params.get('page', 1)
-    page_size = params.get('page_size', 15)
-    from_date = params.get('from_date', 0)
-    to_date = params.get('to_date', get_timestamp_now())
-    search_name = params.get('search_name', '')
-    search_name = urllib.parse.unquote(search_name, encoding='utf-8', errors='replace').strip()
-    search_name = escape_wildcard(search_name)
-    sort_by = params.get('sort_by', None)
-    order_by = params.get('order_by', 'desc')
-
-    # 3. Query
-    query = FrequentQuestion.query
-    if len(search_name):
-        query = query.filter(FrequentQuestion.question.like("%{}%".format(search_name)))
-    query = query.filter(and_(FrequentQuestion.created_date > from_date, FrequentQuestion.created_date < to_date))
-    # 4. Sort by column
-    if sort_by:
-        column_sorted = getattr(FrequentQuestion, sort_by)
-        if order_by == 'asc':
-            query = query.order_by(asc(column_sorted))
-        else:
-            query = query.order_by(desc(column_sorted))
-    # Default: sort by created date
-    else:
-        query = query.order_by(FrequentQuestion.created_date.desc())
-
-    # 5. Paginator
-    paginator = paginate(query, page_number, page_size)
-    # 6. Dump data
+    # 2. Query
+    try:
+        paginator = frequent_question_list.execute(params)
+    except ValidationError as err:
+        return send_error(message_id=FAIL, data=err.messages)
+    # 3. Dump data
     frequent_questions = FrequentQuestionSchema(many=True).dump(paginator.items)
     response_data = dict(
         frequent_questions=frequent_questions,
         total_pages=paginator.pages,
         total=paginator.total
     )
+    if params.get('cursor') is not None:
+        response_data['next_cursor'] = paginator.next_cursor
     return send_result(data=response_data)
 
 
@@ -89,7 +67,7 @@ def create_frequent_question():
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = CreateFrequentQuestionValidation()
+    validator_input = get_validator(CreateFrequentQuestionValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -102,6 +80,7 @@ def create_frequent_question():
     frequent_question.creator_id = current_user_id
     db.session.add(frequent_question)
     db.session.commit()
+    faq_matcher.invalidate()
     return send_result(message_id=SUCCESS, data=FrequentQuestionSchema().dump(frequent_question))
 
 
@@ -129,7 +108,7 @@ def update_frequent_question(frequent_question_id: str):
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = UpdateFrequentQuestionValidation()
+    validator_input = get_validator(UpdateFrequentQuestionValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -141,6 +120,7 @@ def update_frequent_question(frequent_question_id: str):
     frequent_question.creator_id = current_user_id
     db.session.add(frequent_question)
     db.session.commit()
+    faq_matcher.invalidate()
     return send_result(data=FrequentQuestionSchema().dump(frequent_question), message_id=SUCCESS)
 
 
@@ -157,6 +137,7 @@ def delete_frequent_question(frequent_question_id: str):
         return send_error(message_id=FAIL)
     db.session.delete(frequent_question)
     db.session.commit()
+    faq_matcher.invalidate()
     return send_result(message_id=SUCCESS)
 
 
@@ -1,21 +1,21 @@
-import urllib
 import uuid
 
 from flask import Blueprint, request
 from flask_jwt_extended import get_jwt_identity
 from marshmallow import ValidationError
-from sqlalchemy import or_, asc, desc, and_
-from sqlalchemy_pagination import paginate
-from app.api.helper import send_error, send_result
+from app.api.helper import send_error, send_result, invalidate_group_permissions
 from app.enums import FAIL, SUCCESS
 from app.extensions import db
+from app.list_query import ListQuery
 from app.gateway import authorization_require
-from app.schema_validator import CreateGroupValidation, GroupSchema, UpdateGroupValidation, GetGroupValidation
+from app.schema_validator import CreateGroupValidation, GroupSchema, UpdateGroupValidation, GetGroupValidation, \
+    get_validator
 from app.models import User, Group, GroupRole, Role
 
-from app.utils import escape_wildcard, get_timestamp_now
 
 api = Blueprint('admin/groups', __name__)
+group_list = ListQuery('groups', Group, search_columns=[Group.name, Group.description],
+                       sort_columns=['name', 'created_date', 'modified_date'])
 ROLE_AUTH_DEFAULT = "c9a68356-6495-11ec-90d6-0242ac130033"
 
 
@@ -29,48 +29,24 @@ def get_groups():
     # 1. validate request parameters
     try:
         params = request.args
-        params = GetGroupValidation().load(params) if params else dict()
+        params = get_validator(GetGroupValidation).load(params) if params else dict()
     except ValidationError as err:
         return send_error(message_id=FAIL, data=err.messages)
 
-    # 2. Process input
-    page_number = params.get('page', 1)
-    page_size = params.get('page_size', 15)
-    from_date = params.get('from_date', 0)
-    to_date = params.get('to_date', get_timestamp_now())
-    search_name = params.get('search_name', '')
-    search_name = urllib.parse.unquote(search_name, encoding='utf-8', errors='replace').strip()
-    search_name = escape_wildcard(search_name)
-    sort_by = params.get('sort_by', None)
-    order_by = params.get('order_by', 'desc')
-
-    # 3. Query
-    query = Group.query
-    if len(search_name):
-        query = query.filter(
-            or_(Group.name.like("%{}%".format(search_name)),
-                Group.description.like("%{}%".format(search_name))))
-    query = query.filter(and_(Group.created_date > from_date, Group.created_date < to_date))
-    # 4. Sort by collum
-    if sort_by:
-        column_sorted = getattr(Group, sort_by)
-        if order_by == 'asc':
-            query = query.order_by(asc(column_sorted))
-        else:
-            query = query.order_by(desc(column_sorted))
-    # Default: sort by created date
-    else:
-        query = query.order_by(Group.created_date.desc())
-
-    # 5. Paginator
-    paginator = paginate(query, page_number, page_size)
-    # 6. Dump data
+    # 2. Query
+    try:
+        paginator = group_list.execute(params)
+    except ValidationError as err:
+        return send_error(message_id=FAIL, data=err.messages)
+    # 3. Dump data
     groups = GroupSchema(many=True).dump(paginator.items)
     response_data = dict(
         groups=groups,
         total_pages=paginator.pages,
         total=paginator.total
     )
+    if params.get('cursor') is not None:
+        response_data['next_cursor'] = paginator.next_cursor
     return send_result(data=response_data)
 
 
@@ -95,7 +71,7 @@ def create_group():
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = CreateGroupValidation()
+    validator_input = get_validator(CreateGroupValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -151,7 +127,7 @@ def update_group(group_id: str):
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = UpdateGroupValidation()
+    validator_input = get_validator(UpdateGroupValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -180,6 +156,7 @@ def update_group(group_id: str):
                              role_id=role_id, creator_id=current_user_id)
         db.session.add(instance)
     db.session.commit()
+    invalidate_group_permissions(group_id)
     return send_result(data=GroupSchema().dump(group), message_id=SUCCESS)
 
 
@@ -196,6 +173,7 @@ def delete_group(group_id: str):
         return send_error(message_id=FAIL)
     db.session.delete(group)
     db.session.commit()
+    invalidate_group_permissions(group_id)
     return send_result(message_id=SUCCESS)
 
 
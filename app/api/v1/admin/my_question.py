@@ -1,22 +1,29 @@
-import urllib
 import uuid
 
 from flask import Blueprint, request
 from flask_jwt_extended import get_jwt_identity
 from marshmallow import ValidationError
-from sqlalchemy import or_, asc, desc, and_
-from sqlalchemy_pagination import paginate
-from app.api.helper import send_error, send_result
+from sqlalchemy import select
+from app.api.helper import send_error, send_result, dump_frequent_questions
 from app.enums import FAIL, SUCCESS
 from app.extensions import db
+from app.list_query import ListQuery, question_fulltext
 from app.gateway import authorization_require
 from app.schema_validator import GroupSchema, QuestionSchema, UpdateQuestionValidation, \
-    CreateQuestionValidation, GetQuestionValidation, GetQuestionDetailValidation, CommentSchema, CreateCommentValidation
-from app.models import User, Group, Question, Comment, History
+    CreateQuestionValidation, GetQuestionValidation, GetQuestionDetailValidation, CommentSchema, \
+    CreateCommentValidation, get_validator, get_fieldset, GetFieldsetValidation
+from app.models import User, Group, Question, Comment, History, QuestionParticipant
+from app.similarity import question_duplicate_index
 
-from app.utils import escape_wildcard, get_timestamp_now
+from app.utils import paginate
 
 api = Blueprint('my_questions', __name__)
+my_question_list = ListQuery('my_questions', Question, search_columns=[Question.title, Question.description],
+                             sort_columns=['title', 'created_date', 'modified_date'], search_index=question_fulltext,
+                             filters={'status': Question.status,
+                                      'participant_id': lambda user_id: Question.id.in_(
+                                          select(QuestionParticipant.question_id)
+                                          .where(QuestionParticipant.user_id == user_id))})
 
 
 @api.route('', methods=['GET'])
@@ -29,52 +36,27 @@ def get_questions():
     # 1. validate request parameters
     try:
         params = request.args
-        params = GetQuestionValidation().load(params) if params else dict()
+        params = get_validator(GetQuestionValidation).load(params) if params else dict()
+        only = get_fieldset(QuestionSchema, params)
         current_user_id = get_jwt_identity()
     except ValidationError as err:
         return send_error(message_id=FAIL, data=err.messages)
 
-    # 2. Process input
-    page_number = params.get('page', 1)
-    page_size = params.get('page_size', 15)
-    from_date = params.get('from_date', 0)
-    to_date = params.get('to_date', get_timestamp_now())
-    search_name = params.get('search_name', '')
-    search_name = urllib.parse.unquote(search_name, encoding='utf-8', errors='replace').strip()
-    search_name = escape_wildcard(search_name)
-    sort_by = params.get('sort_by', None)
-    order_by = params.get('order_by', 'desc')
-    status = params.get('status', None)
-    # 3. Query
-    query = Question.query
-    query = query.filter(or_(Question.creator_id == current_user_id, Question.user_id == current_user_id))
-    if len(search_name):
-        query = query.filter(
-            or_(Question.title.like("%{}%".format(search_name)),
-                Question.description.like("%{}%".format(search_name))))
-    if status:
-        query = query.filter(Question.status == status)
-    query = query.filter(and_(Question.created_date > from_date, Question.created_date < to_date))
-    # 4. Sort by collum
-    if sort_by:
-        column_sorted = getattr(Question, sort_by)
-        if order_by == 'asc':
-            query = query.order_by(asc(column_sorted))
-        else:
-            query = query.order_by(desc(column_sorted))
-    # Default: sort by created date
-    else:
-        query = query.order_by(Question.created_date.desc())
-
-    # 5. Paginator
-    paginator = paginate(query, page_number, page_size)
-    # 6. Dump data
-    questions = QuestionSchema(many=True).dump(paginator.items)
+    params['participant_id'] = current_user_id
+    # 2. Query
+    try:
+        paginator = my_question_list.execute(params)
+    except ValidationError as err:
+        return send_error(message_id=FAIL, data=err.messages)
+    # 3. Dump data
+    questions = QuestionSchema(many=True, only=only).dump(paginator.items)
     response_data = dict(
         questions=questions,
         total_pages=paginator.pages,
         total=paginator.total
     )
+    if params.get('cursor') is not None:
+        response_data['next_cursor'] = paginator.next_cursor
     return send_result(data=response_data)
 
 
@@ -95,7 +77,7 @@ def create_question():
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = CreateQuestionValidation()
+    validator_input = get_validator(CreateQuestionValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -117,7 +99,11 @@ def create_question():
     history.status = 0
     db.session.add(history)
     db.session.commit()
-    return send_result(message_id=SUCCESS, data=QuestionSchema().dump(question))
+    data = QuestionSchema().dump(question)
+    data['frequent_questions'] = dump_frequent_questions(question)
+    # near-duplicates can be questions of other students, only staff get them from /questions
+    question_duplicate_index.add(question)
+    return send_result(message_id=SUCCESS, data=data)
 
 
 @api.route('/<question_id>', methods=['PUT'])
@@ -144,7 +130,7 @@ def update_question(question_id: str):
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = UpdateQuestionValidation()
+    validator_input = get_validator(UpdateQuestionValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -156,6 +142,7 @@ def update_question(question_id: str):
     question.creator_id = current_user_id
     db.session.add(question)
     db.session.commit()
+    question_duplicate_index.add(question)
     return send_result(data=QuestionSchema().dump(question), message_id=SUCCESS)
 
 
@@ -172,16 +159,25 @@ def delete_question(question_id: str):
         return send_error(message_id=FAIL)
     db.session.delete(question)
     db.session.commit()
+    question_duplicate_index.remove(question_id)
     return send_result(message_id=SUCCESS)
 
 
 @api.route('/<question_id>', methods=['GET'])
 @authorization_require()
 def get_by_id(question_id: str):
+    # 1. validate request parameters
+    try:
+        params = request.args
+        params = get_validator(GetFieldsetValidation).load(params) if params else dict()
+        only = get_fieldset(QuestionSchema, params)
+    except ValidationError as err:
+        return send_error(message_id=FAIL, data=err.messages)
+
     question: Question = Question.get_by_id(question_id)
     if question is None:
         return send_error(message_id=FAIL)
-    data_result = QuestionSchema().dump(question)
+    data_result = QuestionSchema(only=only).dump(question)
     return send_result(data=data_result)
 
 
@@ -199,13 +195,15 @@ def get_detail_question(question_id: str):
     # 1. validate request parameters
     try:
         params = request.args
-        params = GetQuestionDetailValidation().load(params) if params else dict()
+        params = get_validator(GetQuestionDetailValidation).load(params) if params else dict()
+        only = get_fieldset(CommentSchema, params)
     except ValidationError as err:
         return send_error(message_id=FAIL, data=err.messages)
 
     # 2. Process input
     page_number = params.get('page', 1)
     page_size = params.get('page_size', 15)
+    total = params.get('total', 'exact')
 
     # 3. Query
     query = Comment.query.filter(Comment.question_id == question_id)
@@ -213,9 +211,9 @@ def get_detail_question(question_id: str):
     query = query.order_by(Comment.created_date.desc())
 
     # 5. Paginator
-    paginator = paginate(query, page_number, page_size)
+    paginator = paginate(query, page_number, page_size, total)
     # 6. Dump data
-    comments = CommentSchema(many=True).dump(paginator.items)
+    comments = CommentSchema(many=True, only=only).dump(paginator.items)
     response_data = dict(
         comments=comments,
         total_pages=paginator.pages,
@@ -243,7 +241,7 @@ def create_comment(question_id: str):
     # validate request body
     json_body["question_id"] = question_id
     json_body["sender_id"] = current_user_id
-    validator_input = CreateCommentValidation()
+    validator_input = get_validator(CreateCommentValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -1,24 +1,27 @@
-import urllib
 import uuid
 
 from flask import Blueprint, request
 from flask_jwt_extended import get_jwt_identity
 from marshmallow import ValidationError
-from sqlalchemy import or_, asc, desc, and_
-from sqlalchemy_pagination import paginate
 
-from app.api.helper import send_error, send_result
+from app.api.helper import send_error, send_result, dump_frequent_questions, dump_duplicate_questions
 from app.enums import FAIL, SUCCESS, GROUP_TD_ID, GROUP_QTV_ID, GROUP_USER_ID
 from app.extensions import db
-from app.gateway import authorization_require
+from app.list_query import ListQuery, question_fulltext
+from app.gateway import authorization_require, current_principal
 from app.models import User, Question, Comment, History
 from app.schema_validator import QuestionSchema, UpdateTopicValidation, \
     CreateQuestionValidation, GetQuestionValidation, CreateCommentValidation, GetQuestionDetailValidation, \
     CommentSchema, HistorySchema, UpdateAssigneeQuestionValidation, \
-    UpdateStatusQuestionValidation, UpdateQuestionValidation
-from app.utils import escape_wildcard, get_timestamp_now
+    UpdateStatusQuestionValidation, UpdateQuestionValidation, \
+    get_validator, get_fieldset, GetFieldsetValidation
+from app.similarity import question_duplicate_index
+from app.utils import get_timestamp_now, paginate
 
 api = Blueprint('admin/questions', __name__)
+question_list = ListQuery('questions', Question, search_columns=[Question.title, Question.description],
+                          sort_columns=['title', 'created_date', 'modified_date'], search_index=question_fulltext,
+                          filters={'status': Question.status, 'assignee_user_id': Question.assignee_user_id})
 
 
 @api.route('', methods=['GET'])
@@ -31,56 +34,29 @@ def get_questions():
     # 1. validate request parameters
     try:
         params = request.args
-        params = GetQuestionValidation().load(params) if params else dict()
-        current_user_id = get_jwt_identity()
-        user = User.get_by_id(current_user_id)
-        current_group_id = user.group.id
+        params = get_validator(GetQuestionValidation).load(params) if params else dict()
+        only = get_fieldset(QuestionSchema, params)
+        current_user_id = current_principal.id
+        current_group_id = current_principal.group_id
     except ValidationError as err:
         return send_error(message_id=FAIL, data=err.messages)
 
-    # 2. Process input
-    page_number = params.get('page', 1)
-    page_size = params.get('page_size', 15)
-    from_date = params.get('from_date', 0)
-    to_date = params.get('to_date', get_timestamp_now())
-    search_name = params.get('search_name', '')
-    search_name = urllib.parse.unquote(search_name, encoding='utf-8', errors='replace').strip()
-    search_name = escape_wildcard(search_name)
-    sort_by = params.get('sort_by', None)
-    order_by = params.get('order_by', 'desc')
-    status = params.get('status', None)
-
-    # 3. Query
-    query = Question.query
-    if len(search_name):
-        query = query.filter(
-            or_(Question.title.like("%{}%".format(search_name)),
-                Question.description.like("%{}%".format(search_name))))
-    query = query.filter(and_(Question.created_date > from_date, Question.created_date < to_date))
     if current_group_id != GROUP_TD_ID and current_group_id != GROUP_QTV_ID:
-        query = query.filter(Question.assignee_user_id == current_user_id)
-    if status:
-        query = query.filter(Question.status == status)
-    # 4. Sort by collum
-    if sort_by:
-        column_sorted = getattr(Question, sort_by)
-        if order_by == 'asc':
-            query = query.order_by(asc(column_sorted))
-        else:
-            query = query.order_by(desc(column_sorted))
-    # Default: sort by created date
-    else:
-        query = query.order_by(Question.created_date.desc())
-
-    # 5. Paginator
-    paginator = paginate(query, page_number, page_size)
-    # 6. Dump data
-    questions = QuestionSchema(many=True).dump(paginator.items)
+        params['assignee_user_id'] = current_user_id
+    # 2. Query
+    try:
+        paginator = question_list.execute(params)
+    except ValidationError as err:
+        return send_error(message_id=FAIL, data=err.messages)
+    # 3. Dump data
+    questions = QuestionSchema(many=True, only=only).dump(paginator.items)
     response_data = dict(
         questions=questions,
         total_pages=paginator.pages,
         total=paginator.total
     )
+    if params.get('cursor') is not None:
+        response_data['next_cursor'] = paginator.next_cursor
     return send_result(data=response_data)
 
 
@@ -101,7 +77,7 @@ def create_question():
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = CreateQuestionValidation()
+    validator_input = get_validator(CreateQuestionValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -114,7 +90,11 @@ def create_question():
     question.creator_id = current_user_id
     db.session.add(question)
     db.session.commit()
-    return send_result(message_id=SUCCESS, data=QuestionSchema().dump(question))
+    data = QuestionSchema().dump(question)
+    data['frequent_questions'] = dump_frequent_questions(question)
+    data['duplicate_questions'] = dump_duplicate_questions(question)
+    question_duplicate_index.add(question)
+    return send_result(message_id=SUCCESS, data=data)
 
 
 @api.route('/<question_id>', methods=['PUT'])
@@ -141,7 +121,7 @@ def update_question(question_id: str):
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = UpdateQuestionValidation()
+    validator_input = get_validator(UpdateQuestionValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -153,6 +133,7 @@ def update_question(question_id: str):
     question.creator_id = current_user_id
     db.session.add(question)
     db.session.commit()
+    question_duplicate_index.add(question)
     return send_result(data=QuestionSchema().dump(question), message_id=SUCCESS)
 
 
@@ -165,14 +146,13 @@ def assignee_question(question_id: str):
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = UpdateAssigneeQuestionValidation()
+    validator_input = get_validator(UpdateAssigneeQuestionValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
 
     # create question
-    assignee_user = User.get_by_id(json_body["assignee_user_id"])
-    assignee_user_group_id = assignee_user.group.id
+    assignee_user_group_id = User.get_group_id(json_body["assignee_user_id"])
     question = Question.get_by_id(question_id)
     question.assignee_user_id = json_body["assignee_user_id"]
     if assignee_user_group_id != GROUP_TD_ID and assignee_user_group_id != GROUP_USER_ID:
@@ -202,7 +182,7 @@ def status_question(question_id: str):
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = UpdateStatusQuestionValidation()
+    validator_input = get_validator(UpdateStatusQuestionValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -238,16 +218,25 @@ def delete_question(question_id: str):
         return send_error(message_id=FAIL)
     db.session.delete(question)
     db.session.commit()
+    question_duplicate_index.remove(question_id)
     return send_result(message_id=SUCCESS)
 
 
 @api.route('/<question_id>', methods=['GET'])
 @authorization_require()
 def get_by_id(question_id: str):
+    # 1. validate request parameters
+    try:
+        params = request.args
+        params = get_validator(GetFieldsetValidation).load(params) if params else dict()
+        only = get_fieldset(QuestionSchema, params)
+    except ValidationError as err:
+        return send_error(message_id=FAIL, data=err.messages)
+
     question: Question = Question.get_by_id(question_id)
     if question is None:
         return send_error(message_id=FAIL)
-    data_result = QuestionSchema().dump(question)
+    data_result = QuestionSchema(only=only).dump(question)
     return send_result(data=data_result)
 
 
@@ -265,13 +254,15 @@ def get_detail_comment_question(question_id: str):
     # 1. validate request parameters
     try:
         params = request.args
-        params = GetQuestionDetailValidation().load(params) if params else dict()
+        params = get_validator(GetQuestionDetailValidation).load(params) if params else dict()
+        only = get_fieldset(CommentSchema, params)
     except ValidationError as err:
         return send_error(message_id=FAIL, data=err.messages)
 
     # 2. Process input
     page_number = params.get('page', 1)
     page_size = params.get('page_size', 15)
+    total = params.get('total', 'exact')
 
     # 3. Query
     query = Comment.query.filter(Comment.question_id == question_id)
@@ -279,9 +270,9 @@ def get_detail_comment_question(question_id: str):
     query = query.order_by(Comment.created_date.desc())
 
     # 5. Paginator
-    paginator = paginate(query, page_number, page_size)
+    paginator = paginate(query, page_number, page_size, total)
     # 6. Dump data
-    comments = CommentSchema(many=True).dump(paginator.items)
+    comments = CommentSchema(many=True, only=only).dump(paginator.items)
     response_data = dict(
         comments=comments,
         total_pages=paginator.pages,
@@ -304,13 +295,15 @@ def get_detail_history_question(question_id: str):
     # 1. validate request parameters
     try:
         params = request.args
-        params = GetQuestionDetailValidation().load(params) if params else dict()
+        params = get_validator(GetQuestionDetailValidation).load(params) if params else dict()
+        only = get_fieldset(HistorySchema, params)
     except ValidationError as err:
         return send_error(message_id=FAIL, data=err.messages)
 
     # 2. Process input
     page_number = params.get('page', 1)
     page_size = params.get('page_size', 15)
+    total = params.get('total', 'exact')
 
     # 3. Query
     query = History.query.filter(History.question_id == question_id)
@@ -318,9 +311,9 @@ def get_detail_history_question(question_id: str):
     query = query.order_by(History.created_date.asc())
 
     # 5. Paginator
-    paginator = paginate(query, page_number, page_size)
+    paginator = paginate(query, page_number, page_size, total)
     # 6. Dump data
-    histories = HistorySchema(many=True).dump(paginator.items)
+    histories = HistorySchema(many=True, only=only).dump(paginator.items)
     response_data = dict(
         histories=histories,
         total_pages=paginator.pages,
@@ -348,7 +341,7 @@ def create_comment(question_id: str):
     # validate request body
     json_body["question_id"] = question_id
     json_body["sender_id"] = current_user_id
-    validator_input = CreateCommentValidation()
+    validator_input = get_validator(CreateCommentValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -14,7 +14,7 @@ from app.extensions import db
 from app.gateway import authorization_require
 from app.schema_validator import FrequentQuestionSchema, UpdateFrequentQuestionValidation, \
     CreateFrequentQuestionValidation, GetFrequentQuestionValidation, GetStatisticQuestionValidation, QuestionSchema, \
-    TopicSchema, StatisticTopicSchema
+    TopicSchema, StatisticTopicSchema, get_validator
 from app.models import User, FrequentQuestion, Question, TopicQuestion, session
 from app.utils import escape_wildcard, get_timestamp_now
 
@@ -32,7 +32,7 @@ def get_questions():
     # 1. validate request parameters
     try:
         params = request.args
-        params = GetStatisticQuestionValidation().load(params) if params else dict()
+        params = get_validator(GetStatisticQuestionValidation).load(params) if params else dict()
     except ValidationError as err:
         return send_error(message_id=FAIL, data=err.messages)
 
@@ -1,21 +1,21 @@
-import urllib
 import uuid
 
 from flask import Blueprint, request
 from flask_jwt_extended import get_jwt_identity
 from marshmallow import ValidationError
-from sqlalchemy import or_, asc, desc, and_
-from sqlalchemy_pagination import paginate
 from app.api.helper import send_error, send_result
 from app.enums import FAIL, SUCCESS
 from app.extensions import db
+from app.list_query import ListQuery
 from app.gateway import authorization_require
-from app.schema_validator import SubjectSchema, GetSubjectValidation, CreateSubjectValidation, UpdateSubjectValidation
+from app.schema_validator import SubjectSchema, GetSubjectValidation, CreateSubjectValidation, \
+    UpdateSubjectValidation, get_validator
 from app.models import User, Subject
 
-from app.utils import escape_wildcard, get_timestamp_now
 
 api = Blueprint('admin/subjects', __name__)
+subject_list = ListQuery('subjects', Subject, search_columns=[Subject.name, Subject.code],
+                         sort_columns=['name', 'created_date', 'modified_date'])
 
 
 @api.route('', methods=['GET'])
@@ -28,48 +28,24 @@ def get_subjects():
     # 1. validate request parameters
     try:
         params = request.args
-        params = GetSubjectValidation().load(params) if params else dict()
+        params = get_validator(GetSubjectValidation).load(params) if params else dict()
     except ValidationError as err:
         return send_error(message_id=FAIL, data=err.messages)
 
-    # 2. Process input
-    page_number = params.get('page', 1)
-    page_size = params.get('page_size', 15)
-    from_date = params.get('from_date', 0)
-    to_date = params.get('to_date', get_timestamp_now())
-    search_name = params.get('search_name', '')
-    search_name = urllib.parse.unquote(search_name, encoding='utf-8', errors='replace').strip()
-    search_name = escape_wildcard(search_name)
-    sort_by = params.get('sort_by', None)
-    order_by = params.get('order_by', 'desc')
-
-    # 3. Query
-    query = Subject.query
-    if len(search_name):
-        query = query.filter(
-            or_(Subject.name.like("%{}%".format(search_name)),
-                Subject.code.like("%{}%".format(search_name))))
-    query = query.filter(and_(Subject.created_date > from_date, Subject.created_date < to_date))
-    # 4. Sort by collum
-    if sort_by:
-        column_sorted = getattr(Subject, sort_by)
-        if order_by == 'asc':
-            query = query.order_by(asc(column_sorted))
-        else:
-            query = query.order_by(desc(column_sorted))
-    # Default: sort by created date
-    else:
-        query = query.order_by(Subject.created_date.desc())
-
-    # 5. Paginator
-    paginator = paginate(query, page_number, page_size)
-    # 6. Dump data
+    # 2. Query
+    try:
+        paginator = subject_list.execute(params)
+    except ValidationError as err:
+        return send_error(message_id=FAIL, data=err.messages)
+    # 3. Dump data
     subjects = SubjectSchema(many=True).dump(paginator.items)
     response_data = dict(
         subjects=subjects,
         total_pages=paginator.pages,
         total=paginator.total
     )
+    if params.get('cursor') is not None:
+        response_data['next_cursor'] = paginator.next_cursor
     return send_result(data=response_data)
 
 
@@ -90,7 +66,7 @@ def create_subject():
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = CreateSubjectValidation()
+    validator_input = get_validator(CreateSubjectValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -130,7 +106,7 @@ def update_subject(subject_id: str):
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = UpdateSubjectValidation()
+    validator_input = get_validator(UpdateSubjectValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
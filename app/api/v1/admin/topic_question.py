@@ -1,22 +1,21 @@
-import urllib
 import uuid
 
 from flask import Blueprint, request
 from flask_jwt_extended import get_jwt_identity
 from marshmallow import ValidationError
-from sqlalchemy import or_, asc, desc, and_
-from sqlalchemy_pagination import paginate
 from app.api.helper import send_error, send_result
 from app.enums import FAIL, SUCCESS
 from app.extensions import db
+from app.list_query import ListQuery
 from app.gateway import authorization_require
 from app.schema_validator import GroupSchema, TopicSchema, UpdateTopicValidation, \
-    CreateTopicValidation, GetTopicValidation
+    CreateTopicValidation, GetTopicValidation, get_validator
 from app.models import User, Group, TopicQuestion
 
-from app.utils import escape_wildcard, get_timestamp_now
 
 api = Blueprint('admin/topics', __name__)
+topic_list = ListQuery('topics', TopicQuestion, search_columns=[TopicQuestion.name, TopicQuestion.description],
+                       sort_columns=['name', 'created_date', 'modified_date'])
 
 
 @api.route('', methods=['GET'])
@@ -29,48 +28,24 @@ def get_topics():
     # 1. validate request parameters
     try:
         params = request.args
-        params = GetTopicValidation().load(params) if params else dict()
+        params = get_validator(GetTopicValidation).load(params) if params else dict()
     except ValidationError as err:
         return send_error(message_id=FAIL, data=err.messages)
 
-    # 2. Process input
-    page_number = params.get('page', 1)
-    page_size = params.get('page_size', 15)
-    from_date = params.get('from_date', 0)
-    to_date = params.get('to_date', get_timestamp_now())
-    search_name = params.get('search_name', '')
-    search_name = urllib.parse.unquote(search_name, encoding='utf-8', errors='replace').strip()
-    search_name = escape_wildcard(search_name)
-    sort_by = params.get('sort_by', None)
-    order_by = params.get('order_by', 'desc')
-
-    # 3. Query
-    query = TopicQuestion.query
-    if len(search_name):
-        query = query.filter(
-            or_(TopicQuestion.name.like("%{}%".format(search_name)),
-                TopicQuestion.description.like("%{}%".format(search_name))))
-    query = query.filter(and_(TopicQuestion.created_date > from_date, TopicQuestion.created_date < to_date))
-    # 4. Sort by collum
-    if sort_by:
-        column_sorted = getattr(TopicQuestion, sort_by)
-        if order_by == 'asc':
-            query = query.order_by(asc(column_sorted))
-        else:
-            query = query.order_by(desc(column_sorted))
-    # Default: sort by created date
-    else:
-        query = query.order_by(TopicQuestion.created_date.desc())
-
-    # 5. Paginator
-    paginator = paginate(query, page_number, page_size)
-    # 6. Dump data
+    # 2. Query
+    try:
+        paginator = topic_list.execute(params)
+    except ValidationError as err:
+        return send_error(message_id=FAIL, data=err.messages)
+    # 3. Dump data
     topics = TopicSchema(many=True).dump(paginator.items)
     response_data = dict(
         topics=topics,
         total_pages=paginator.pages,
         total=paginator.total
     )
+    if params.get('cursor') is not None:
+        response_data['next_cursor'] = paginator.next_cursor
     return send_result(data=response_data)
 
 
@@ -91,7 +66,7 @@ def create_topic():
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = CreateTopicValidation()
+    validator_input = get_validator(CreateTopicValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -131,7 +106,7 @@ def update_topic(topic_id: str):
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = UpdateTopicValidation()
+    validator_input = get_validator(UpdateTopicValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -1,23 +1,25 @@
-import urllib
 import uuid
 
 from flask import Blueprint, request
 from flask_jwt_extended import get_jwt_identity
 from marshmallow import ValidationError
-from sqlalchemy import or_, asc, desc, and_
-from sqlalchemy_pagination import paginate
-from werkzeug.security import generate_password_hash
 
 from app.api.helper import send_error, send_result
 from app.enums import FAIL, SUCCESS
-from app.extensions import db
-from app.gateway import authorization_require
-from app.schema_validator import CreateUserValidation, UpdateUserValidation, UserSchema, GetUserValidation, RoleSchema
-from app.models import User, Role
+from app.extensions import db, password_hasher
+from app.list_query import ListQuery, user_trigram_index
+from app.loader import user_summaries
+from app.gateway import authorization_require, current_principal, invalidate_principal
+from app.security import PasswordPoolBusy
+from app.schema_validator import CreateUserValidation, UpdateUserValidation, UserSchema, GetUserValidation, \
+    RoleSchema, get_validator, get_fieldset, GetFieldsetValidation
+from app.models import User, Group, Token
 
-from app.utils import escape_wildcard, get_timestamp_now
 
 api = Blueprint('admin/users', __name__)
+user_list = ListQuery('users', User, search_columns=[User.username, User.email, User.first_name, User.last_name],
+                      sort_columns=['username', 'email', 'first_name', 'last_name', 'created_date', 'modified_date'],
+                      filters={'group_id': User.group_id}, search_index=user_trigram_index)
 
 
 @api.route('', methods=['GET'])
@@ -30,56 +32,25 @@ def get_users():
     # 1. validate request parameters
     try:
         params = request.args
-        params = GetUserValidation().load(params) if params else dict()
-        current_user_id = get_jwt_identity()
-        user = User.get_by_id(current_user_id)
-        group_id = user.group.id
+        params = get_validator(GetUserValidation).load(params) if params else dict()
+        only = get_fieldset(UserSchema, params)
     except ValidationError as err:
         return send_error(message_id=FAIL, data=err.messages)
 
-    # 2. Process input
-    page_number = params.get('page', 1)
-    page_size = params.get('page_size', 15)
-    from_date = params.get('from_date', 0)
-    to_date = params.get('to_date', get_timestamp_now())
-    search_name = params.get('search_name', '')
-    search_name = urllib.parse.unquote(search_name, encoding='utf-8', errors='replace').strip()
-    search_name = escape_wildcard(search_name)
-    sort_by = params.get('sort_by', None)
-    order_by = params.get('order_by', 'desc')
-    group_id = params.get('group_id', None)
-
-    # 3. Query
-    query = User.query
-    if len(search_name):
-        query = query.filter(
-            or_(User.username.like("%{}%".format(search_name)),
-                User.email.like("%{}%".format(search_name)),
-                User.first_name.like("%{}%".format(search_name)),
-                User.last_name.like("%{}%".format(search_name))))
-    query = query.filter(and_(User.created_date > from_date, User.created_date < to_date))
-    if group_id:
-        query = query.filter(User.group_id == group_id)
-    # 4. Sort by collum
-    if sort_by:
-        column_sorted = getattr(User, sort_by)
-        if order_by == 'asc':
-            query = query.order_by(asc(column_sorted))
-        else:
-            query = query.order_by(desc(column_sorted))
-    # Default: sort by created date
-    else:
-        query = query.order_by(User.created_date.desc())
-
-    # 5. Paginator
-    paginator = paginate(query, page_number, page_size)
-    # 6. Dump data
-    users = UserSchema(many=True).dump(paginator.items)
+    # 2. Query
+    try:
+        paginator = user_list.execute(params)
+    except ValidationError as err:
+        return send_error(message_id=FAIL, data=err.messages)
+    # 3. Dump data
+    users = UserSchema(many=True, only=only).dump(paginator.items)
     response_data = dict(
         users=users,
         total_pages=paginator.pages,
         total=paginator.total
     )
+    if params.get('cursor') is not None:
+        response_data['next_cursor'] = paginator.next_cursor
     return send_result(data=response_data)
 
 
@@ -105,7 +76,7 @@ def create_user():
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = CreateUserValidation()
+    validator_input = get_validator(CreateUserValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
@@ -114,7 +85,10 @@ def create_user():
     user = User()
     for key in json_body.keys():
         user.__setattr__(key, json_body[key])
-    user.password_hash = generate_password_hash(user.password)
+    try:
+        user.password_hash = password_hasher.hash(user.password)
+    except PasswordPoolBusy:
+        return send_error(message="Server is busy, please try again later", code=503)
     user.id = user_id
     user.creator_id = current_user_id
     db.session.add(user)
@@ -147,17 +121,30 @@ def update_user(user_id: str):
     except Exception as ex:
         return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
     # validate request body
-    validator_input = UpdateUserValidation()
+    validator_input = get_validator(UpdateUserValidation)
     is_not_validate = validator_input.validate(json_body)
     if is_not_validate:
         return send_error(data=is_not_validate, message_id=FAIL)
     # create user
     user = User.get_by_id(user_id)
+    password_changed = bool(json_body.get("password")) and json_body["password"] != user.password
+    # the group_id claim and the permissions of the tokens would keep the old group
+    group_changed = "group_id" in json_body and json_body["group_id"] != user.group_id
     for key in json_body.keys():
         user.__setattr__(key, json_body[key])
+    if json_body.get("password"):
+        try:
+            user.password_hash = password_hasher.hash(json_body["password"])
+        except PasswordPoolBusy:
+            return send_error(message="Server is busy, please try again later", code=503)
     user.creator_id = current_user_id
     db.session.add(user)
     db.session.commit()
+    if password_changed or group_changed:
+        # a password reset or a group change by an admin ends the sessions of the user
+        Token.revoke_all_token(user_id)
+    invalidate_principal(user_id)
+    user_summaries.invalidate(user_id)
     return send_result(data=UserSchema().dump(user), message_id=SUCCESS)
 
 
@@ -172,20 +159,20 @@ def delete_user(user_id: str):
     user = User.get_by_id(user_id)
     if not user:
         return send_error(message_id=FAIL)
+    # before the delete, "epoch" revocation mode bumps the token_epoch of the user
+    Token.revoke_all_token(user_id)
     db.session.delete(user)
     db.session.commit()
+    invalidate_principal(user_id)
+    user_summaries.invalidate(user_id)
     return send_result(message_id=SUCCESS)
 
 
 @api.route('/roles', methods=['GET'])
 @authorization_require()
 def get_role_permission():
-    try:
-        current_user_id = get_jwt_identity()
-    except Exception as ex:
-        return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
-    user = User.get_by_id(current_user_id)
-    user_roles = user.group.roles
+    group = Group.get_by_id(current_principal.group_id)
+    user_roles = group.roles if group else []
     roles = RoleSchema(many=True).dump(user_roles)
     response_data = dict(
         roles=roles
@@ -196,22 +183,26 @@ def get_role_permission():
 @api.route('/<user_id>', methods=['GET'])
 @authorization_require()
 def get_by_id(user_id: str):
+    # 1. validate request parameters
+    try:
+        params = request.args
+        params = get_validator(GetFieldsetValidation).load(params) if params else dict()
+        only = get_fieldset(UserSchema, params)
+    except ValidationError as err:
+        return send_error(message_id=FAIL, data=err.messages)
+
     user: User = User.get_by_id(user_id)
     if user is None:
         return send_error(message_id=FAIL)
-    data_result = UserSchema().dump(user)
+    data_result = UserSchema(only=only).dump(user)
     return send_result(data=data_result)
 
 
 @api.route('/imports', methods=['POST'])
 @authorization_require()
 def import_users():
-    try:
-        current_user_id = get_jwt_identity()
-    except Exception as ex:
-        return send_error(message="Request Body incorrect json format: " + str(ex), code=442)
-    user = User.get_by_id(current_user_id)
-    user_roles = user.group.roles
+    group = Group.get_by_id(current_principal.group_id)
+    user_roles = group.roles if group else []
     roles = RoleSchema(many=True).dump(user_roles)
     response_data = dict(
         roles=roles
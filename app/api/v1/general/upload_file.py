@@ -8,6 +8,7 @@ from app.api.helper import send_result, send_error
 from app.enums import FILE_PATH, URL_SERVER
 from app.utils import get_timestamp_now
 from app.schema_validator import UploadValidation
+from app.schema_validator import get_validator
 
 api = Blueprint('general/upload', __name__)
 
@@ -28,7 +29,7 @@ def upload_file():
     prefix = request.args.get('prefix', "", type=str).strip()
 
     # validate request params
-    validator_upload = UploadValidation()
+    validator_upload = get_validator(UploadValidation)
     is_invalid = validator_upload.validate({"prefix": prefix})
     if is_invalid:
         return send_error(data=is_invalid, message='Please check your request params')
@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
+import os
+import threading
+import time
 from time import strftime
 from flask import Flask, request
 from app.extensions import jwt
 from app.api import v1 as api_v1
-from app.extensions import logger, parser, db
+from app.extensions import logger, parser, db, revoked_store, verified_token_cache, \
+    password_hasher, count_cache
 from .enums import TIME_FORMAT_LOG, FAIL
 from .settings import ProdConfig
-from app.api.helper import send_error, send_result
+from app.api.helper import send_error, send_result, message_catalog
+from app.models import Token, TopicQuestion
+from app.gateway import permission_registry
+from app.list_query import ListQuery
+from app.similarity import faq_matcher, question_duplicate_index
+from app.loader import user_summaries
 from flask_cors import CORS
 
 
@@ -23,6 +32,12 @@ def create_app(config_object=ProdConfig):
     register_extensions(app, config_object)
     register_blueprints(app)
     register_monitor(app)
+    # after every route is registered
+    permission_registry.init_app(app)
+    register_token_pruner(app)
+    register_question_count_repair(app)
+    register_message_catalog(app)
+    register_duplicate_index(app)
     CORS(app)
     return app
 
@@ -40,6 +55,13 @@ def register_extensions(app, config_object):
     db.app = app
     jwt.init_app(app)
     db.init_app(app)
+    revoked_store.init_app(app)
+    verified_token_cache.init_app(app)
+    password_hasher.init_app(app)
+    count_cache.init_app(app)
+    faq_matcher.init_app(app)
+    question_duplicate_index.init_app(app)
+    user_summaries.init_app(app)
     # sio.init_app(app)
 
     # @sio.on_error()  # Handles the default namespace
@@ -126,6 +148,111 @@ def register_monitor(app):
             links.append(permission_route)
         return send_result(data=sorted(links, key=lambda resource: str(resource).split('@')[-1]))
 
+    @app.route("/api/v1/helper/password-pool", methods=['GET'])
+    def password_pool():
+        return send_result(data=password_hasher.metrics())
+
+    @app.route("/api/v1/helper/list-queries", methods=['GET'])
+    def list_queries():
+        return send_result(data={name: list_query.metrics() for name, list_query in ListQuery.registry.items()})
+
+
+def run_job(app, name, job):
+    """Run a background job once inside an application context, logging its failure instead of raising it
+
+    Args:
+        app: Flask handler application
+        name: name of the job in the log
+        job: function without argument
+    """
+    with app.app_context():
+        try:
+            job()
+        except Exception as ex:
+            logger.error('%s %s failed: %s', strftime(TIME_FORMAT_LOG), name, str(ex))
+        finally:
+            db.session.remove()
+
+
+def start_periodic(app, name, interval, job):
+    """Start a daemon thread which runs the job every interval seconds, nothing when interval is 0
+
+    Args:
+        app: Flask handler application
+        name: name of the thread and of the job in the log
+        interval: seconds between two runs
+        job: function without argument, run by run_job
+    """
+    if not interval:
+        return
+    # With the reloader, only the child process serves requests
+    if app.debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            run_job(app, name, job)
+
+    threading.Thread(target=loop, name=name, daemon=True).start()
+
+
+def register_token_pruner(app):
+    """Delete expired tokens every TOKEN_PRUNE_INTERVAL seconds
+
+    Args:
+        app: Flask handler application
+    """
+    batch_size = app.config.get('TOKEN_PRUNE_BATCH_SIZE', 1000)
+
+    def prune():
+        removed = Token.prune_database(batch_size)
+        revoked_store.purge()
+        logger.info('%s Pruned %s expired tokens', strftime(TIME_FORMAT_LOG), removed)
+
+    start_periodic(app, 'token-pruner', app.config.get('TOKEN_PRUNE_INTERVAL', 0), prune)
+
+
+def register_question_count_repair(app):
+    """Recompute the question count of topics every QUESTION_COUNT_REPAIR_INTERVAL seconds
+
+    Args:
+        app: Flask handler application
+    """
+    def repair():
+        fixed = TopicQuestion.repair_question_counts()
+        logger.info('%s Repaired question count of %s topics', strftime(TIME_FORMAT_LOG), fixed)
+
+    start_periodic(app, 'question-count-repair', app.config.get('QUESTION_COUNT_REPAIR_INTERVAL', 0), repair)
+
+
+def register_message_catalog(app):
+    """Load the message catalog, then reload it every MESSAGE_CATALOG_TTL seconds
+
+    Args:
+        app: Flask handler application
+    """
+    def reload():
+        count = message_catalog.reload()
+        logger.info('%s Loaded %s messages', strftime(TIME_FORMAT_LOG), count)
+
+    run_job(app, 'message-catalog', reload)
+    start_periodic(app, 'message-catalog', app.config.get('MESSAGE_CATALOG_TTL', 0), reload)
+
+
+def register_duplicate_index(app):
+    """Build the near-duplicate question index, then rebuild it every DUPLICATE_INDEX_TTL seconds
+
+    Args:
+        app: Flask handler application
+    """
+    def rebuild():
+        count = question_duplicate_index.rebuild()
+        logger.info('%s Indexed %s questions', strftime(TIME_FORMAT_LOG), count)
+
+    run_job(app, 'duplicate-index', rebuild)
+    start_periodic(app, 'duplicate-index', app.config.get('DUPLICATE_INDEX_TTL', 0), rebuild)
+
 
 def register_blueprints(app):
     """Init blueprint for api url
@@ -0,0 +1,378 @@
+import hashlib
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.util import find_tables
+
+_MISSING = object()
+
+
+class TTLCache(object):
+    """
+    Thread-safe in-process LRU cache whose entries also expire after a TTL.
+
+    Args:
+        max_size: maximum number of entries, the least recently used entry is evicted first
+        ttl: default time to live of an entry in seconds, None means entries never expire
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MemoryRevocationBackend(object):
+    """
+    Revocation entries kept in the memory of the current worker process
+    """
+
+    def __init__(self, max_size: int = 100000):
+        self._cache = TTLCache(max_size=max_size)
+
+    def get(self, key: str):
+        return self._cache.get(key)
+
+    def set(self, key: str, value: int, ttl: float):
+        self._cache.set(key, value, ttl=ttl)
+
+    def delete(self, key: str):
+        self._cache.delete(key)
+
+
+class FileRevocationBackend(object):
+    """
+    Revocation entries kept in a SQLite file, so every worker process on the host shares them
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS revocation '
+                           '(key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires REAL NOT NULL)')
+        connection.commit()
+
+    def _connect(self):
+        # one connection per thread, never reuse a connection inherited from a forked parent
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = sqlite3.connect(self.path, timeout=5)
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, key: str):
+        row = self._connect().execute('SELECT value FROM revocation WHERE key = ? AND expires > ?',
+                                      (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: int, ttl: float):
+        connection = self._connect()
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO revocation (key, value, expires) VALUES (?, ?, ?)',
+                               (key, value, time.time() + ttl))
+
+    def delete(self, key: str):
+        connection = self._connect()
+        with connection:
+            connection.execute('DELETE FROM revocation WHERE key = ?', (key,))
+
+    def purge(self):
+        connection = self._connect()
+        with connection:
+            connection.execute('DELETE FROM revocation WHERE expires <= ?', (time.time(),))
+
+
+class RevocationStore(object):
+    """
+    Cache in front of the token table. Values are written through by Token so that checking a
+    token on each request does not hit the database.
+
+    Config:
+        REVOCATION_CACHE_BACKEND: "memory" (per worker) or "file" (shared by the workers of a host)
+        REVOCATION_CACHE_PATH: SQLite file of the "file" backend
+        REVOCATION_CACHE_TTL: max seconds an entry is trusted, an entry never outlives its token
+        REVOCATION_CACHE_SIZE: max entries of the "memory" backend
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 60
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('REVOCATION_CACHE_TTL', 60)
+        backend = app.config.get('REVOCATION_CACHE_BACKEND', 'memory')
+        if backend == 'file':
+            self.backend = FileRevocationBackend(app.config['REVOCATION_CACHE_PATH'])
+        elif backend == 'memory':
+            self.backend = MemoryRevocationBackend(app.config.get('REVOCATION_CACHE_SIZE', 100000))
+        else:
+            raise ValueError('Unknown REVOCATION_CACHE_BACKEND: {}'.format(backend))
+
+    def _ttl(self, expires: int = None):
+        if expires is None:
+            return self.ttl
+        return max(0, min(self.ttl, expires - time.time()))
+
+    def get(self, key: str):
+        """
+        Returns:
+            cached value or None when the key is unknown to the cache
+        """
+        if self.backend is None:
+            return None
+        return self.backend.get(key)
+
+    def set(self, key: str, value: int, expires: int = None):
+        """
+        Args:
+            key:
+            value:
+            expires: unix timestamp after which the entry is useless (token expiry)
+        """
+        if self.backend is None:
+            return
+        ttl = self._ttl(expires)
+        if ttl > 0:
+            self.backend.set(key, value, ttl)
+
+    def delete(self, key: str):
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def purge(self):
+        """
+        Drop expired entries of backends that do not evict by themselves
+        """
+        if hasattr(self.backend, 'purge'):
+            self.backend.purge()
+
+    def is_revoked(self, jti: str):
+        """
+        Returns:
+            True/False when the token is known to the cache, None otherwise
+        """
+        value = self.get('jti:' + jti)
+        return None if value is None else bool(value)
+
+    def set_revoked(self, jti: str, revoked: bool, expires: int = None):
+        self.set('jti:' + jti, int(revoked), expires)
+
+
+class VerifiedTokenCache(object):
+    """
+    Decoded claims of access tokens whose signature was already verified, keyed by a digest of the
+    encoded token. A hit skips the JWT decode and HMAC check, the blacklist check still runs.
+
+    Config:
+        JWT_VERIFIED_CACHE_ENABLED: opt-in, disabled by default
+        JWT_VERIFIED_CACHE_TTL: max seconds an entry is trusted, an entry never outlives its token
+        JWT_VERIFIED_CACHE_SIZE: max entries per worker
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.ttl = 60
+        self._tokens = TTLCache(max_size=0)
+        self._digests = TTLCache(max_size=0)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('JWT_VERIFIED_CACHE_ENABLED', False)
+        self.ttl = app.config.get('JWT_VERIFIED_CACHE_TTL', 60)
+        max_size = app.config.get('JWT_VERIFIED_CACHE_SIZE', 10000)
+        self._tokens = TTLCache(max_size=max_size, ttl=self.ttl)
+        # jti -> digest, to evict a token on revocation
+        self._digests = TTLCache(max_size=max_size, ttl=self.ttl)
+
+    @staticmethod
+    def digest(encoded_token: str) -> str:
+        return hashlib.sha256(encoded_token.encode('utf-8')).hexdigest()
+
+    def get(self, encoded_token: str):
+        """
+        Returns:
+            (jwt_data, jwt_header) or None
+        """
+        if not self.enabled:
+            return None
+        return self._tokens.get(self.digest(encoded_token))
+
+    def set(self, encoded_token: str, jwt_data: dict, jwt_header: dict):
+        if not self.enabled:
+            return
+        ttl = min(self.ttl, jwt_data.get('exp', 0) - time.time()) if 'exp' in jwt_data else self.ttl
+        if ttl <= 0:
+            return
+        digest = self.digest(encoded_token)
+        self._tokens.set(digest, (jwt_data, jwt_header), ttl=ttl)
+        self._digests.set(jwt_data['jti'], digest, ttl=ttl)
+
+    def evict(self, jti: str):
+        digest = self._digests.get(jti)
+        if digest is not None:
+            self._tokens.delete(digest)
+            self._digests.delete(jti)
+
+
+class CountCache(object):
+    """
+    COUNT(*) of list queries, keyed by the SQL and parameters of the query. Every write committed on a
+    table moves its generation, so counts cached before the write are not read again. Writes made by
+    another worker are only seen after the TTL.
+
+    Config:
+        COUNT_CACHE_TTL: seconds a count is trusted, 0 disables the cache
+        COUNT_CACHE_SIZE: max entries per worker
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 30
+        self._counts = TTLCache(max_size=0)
+        self._generations = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('COUNT_CACHE_TTL', 30)
+        self._counts = TTLCache(max_size=app.config.get('COUNT_CACHE_SIZE', 4096), ttl=self.ttl)
+        if not event.contains(Session, 'after_flush', self._on_flush):
+            event.listen(Session, 'after_flush', self._on_flush)
+            event.listen(Session, 'after_commit', self._on_commit)
+            event.listen(Session, 'after_rollback', self._on_rollback)
+            event.listen(Session, 'after_bulk_update', self._on_bulk)
+            event.listen(Session, 'after_bulk_delete', self._on_bulk)
+
+    def _on_flush(self, session, flush_context):
+        tables = session.info.setdefault('count_cache_tables', set())
+        for instance in itertools.chain(session.new, session.dirty, session.deleted):
+            for table in inspect(instance).mapper.tables:
+                tables.add(table.name)
+
+    def _on_bulk(self, context):
+        tables = context.session.info.setdefault('count_cache_tables', set())
+        for table in context.mapper.tables:
+            tables.add(table.name)
+
+    def _on_commit(self, session):
+        tables = session.info.pop('count_cache_tables', None)
+        if tables:
+            self.invalidate(*tables)
+
+    def _on_rollback(self, session):
+        session.info.pop('count_cache_tables', None)
+
+    def invalidate(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+
+    @staticmethod
+    def get_tables(statement) -> tuple:
+        """
+        Names of the tables read by a statement
+        """
+        return tuple(sorted({table.name for table in find_tables(statement, include_joins=True, include_aliases=True)
+                             if hasattr(table, 'name')}))
+
+    def get_or_count(self, shape, params: dict, tables, count):
+        """
+        Args:
+            shape: hashable description of the statement, ex its SQL
+            params: parameters of the statement
+            tables: tables read by the statement
+            count: callable computing the total on a miss
+        Returns:
+            total
+        """
+        if not self.ttl:
+            return count()
+        generations = [self._generations.get(table, 0) for table in tables]
+        raw = repr((shape, sorted(params.items()), generations))
+        key = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+        total = self._counts.get(key)
+        if total is None:
+            total = count()
+            self._counts.set(key, total)
+        return total
+
+    @staticmethod
+    def explain(connection, statement, params: dict = None) -> int:
+        """
+        Rows the MySQL optimizer expects the statement to return (EXPLAIN), without scanning them
+        """
+        # expanding parameters, ex: the trigrams of TrigramIndex, are only rendered with their values
+        compiled = statement.params(params or {}).compile(dialect=connection.dialect,
+                                                          compile_kwargs={'render_postcompile': True})
+        values = compiled.construct_params()
+        parameters = tuple(values[name] for name in compiled.positiontup)
+        row = connection.exec_driver_sql('EXPLAIN ' + compiled.string, parameters).mappings().first()
+        return int((row['rows'] or 0) * float(row.get('filtered') or 100) / 100) if row else 0
+
+    def count(self, query) -> int:
+        """
+        Exact total of the query, cached
+        """
+        query = query.order_by(None)
+        statement = query.statement
+        compiled = statement.compile()
+        return self.get_or_count(('count', str(compiled)), compiled.params, self.get_tables(statement), query.count)
+
+    def estimate(self, query) -> int:
+        """
+        Total of the query estimated by the MySQL optimizer, other databases get the cached exact count
+        """
+        query = query.order_by(None)
+        connection = query.session.connection()
+        if connection.dialect.name != 'mysql':
+            return self.count(query)
+        statement = query.statement
+        compiled = statement.compile()
+        return self.get_or_count(('estimate', str(compiled)), compiled.params, self.get_tables(statement),
+                                 lambda: self.explain(connection, statement))
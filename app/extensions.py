@@ -7,11 +7,18 @@ from webargs.flaskparser import FlaskParser
 from flask_sqlalchemy import SQLAlchemy
 from logging.handlers import RotatingFileHandler
 
+from app.cache import RevocationStore, VerifiedTokenCache, CountCache
+from app.security import PasswordHasher
+
 parser = FlaskParser()
 
 os.makedirs("logs", exist_ok=True)
 db = SQLAlchemy()
 jwt = JWTManager()
+revoked_store = RevocationStore()
+verified_token_cache = VerifiedTokenCache()
+password_hasher = PasswordHasher()
+count_cache = CountCache()
 # sio = SocketIO(debug=False, log_output=False, cors_allowed_origins="*")
 # # logger
 app_log_handler = RotatingFileHandler('logs/app.log', maxBytes=1000000, backupCount=30)
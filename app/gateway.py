@@ -1,11 +1,241 @@
-from functools import wraps
+import base64
+import hashlib
+from functools import wraps, lru_cache
 
-from flask import request
+from flask import request, _app_ctx_stack
 from flask_jwt_extended import (
-    verify_jwt_in_request, get_jwt_claims
+    verify_jwt_in_request
 )
+from flask_jwt_extended.config import config as jwt_config
+from flask_jwt_extended.utils import verify_token_not_blacklisted, verify_token_claims
+from werkzeug.local import LocalProxy
 
-from app.api.helper import send_error
+from app.api.helper import send_error, get_group_permissions
+from app.cache import TTLCache
+from app.extensions import verified_token_cache
+from app.models import User
+
+
+def get_permission_key(method: str, rule: str) -> str:
+    """
+    Permission resource of a route, ex: "get@/api/v1/admin/users"
+    """
+    return "{0}@{1}".format(method.lower(), rule)
+
+
+class PermissionRegistry(object):
+    """
+    Stable index of every route of the application, built from app.url_map.
+    A set of permissions is stored in the JWT as a bitmap over this index instead of the list of
+    resources. The version changes whenever the route list changes, so bitmaps made for another
+    route list are never read with the wrong index.
+    """
+
+    def __init__(self, app=None):
+        self.keys = ()
+        self.index = {}
+        self.version = None
+        # (endpoint, METHOD) -> (permission key, bit position), resolved once when the app is built
+        self.endpoints = {}
+        self.claims_key = 'user_claims'
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        rules = [(rule, method) for rule in app.url_map.iter_rules()
+                 for method in rule.methods - {'HEAD', 'OPTIONS'}]
+        self.keys = tuple(sorted({get_permission_key(method, rule.rule) for rule, method in rules}))
+        self.index = {key: position for position, key in enumerate(self.keys)}
+        self.version = hashlib.sha1('\n'.join(self.keys).encode('utf-8')).hexdigest()[:8]
+        self.claims_key = app.config.get('JWT_USER_CLAIMS', 'user_claims')
+        self.endpoints = {}
+        for rule, method in rules:
+            key = get_permission_key(method, rule.rule)
+            self.endpoints[(rule.endpoint, method)] = (key, self.index[key])
+
+    def encode(self, permissions) -> str:
+        """
+        Args:
+            permissions: iterable of permission resources
+        Returns:
+            url safe base64 bitmap, resources unknown to the application are ignored
+        """
+        bitmap = 0
+        for permission in permissions:
+            position = self.index.get(permission)
+            if position is not None:
+                bitmap |= 1 << position
+        raw = bitmap.to_bytes((len(self.keys) + 7) // 8, 'little')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def decode(encoded: str) -> int:
+        raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+        return int.from_bytes(raw, 'little')
+
+
+permission_registry = PermissionRegistry()
+
+
+def build_permission_claims(group_id: str) -> dict:
+    """
+    Permission claims of a group, added to the user_claims of access and refresh tokens
+    """
+    return {
+        "group_id": group_id,
+        "permission_bitmap": permission_registry.encode(get_group_permissions(group_id)),
+        "permission_version": permission_registry.version
+    }
+
+
+def get_request_claims() -> dict:
+    """
+    user_claims of the JWT verified for the current request
+    """
+    return getattr(_app_ctx_stack.top, 'jwt', {}).get(permission_registry.claims_key, {})
+
+
+class Principal(object):
+    """
+    The caller of the current request
+    """
+    __slots__ = ('id', 'group_id', 'permission_version')
+
+    def __init__(self, _id: str, group_id: str = None, permission_version: str = None):
+        self.id = _id
+        self.group_id = group_id
+        self.permission_version = permission_version
+
+
+# user_id -> group_id, only used for tokens issued without the group_id claim
+principal_group_cache = TTLCache(max_size=10000, ttl=60)
+
+
+def invalidate_principal(user_id: str):
+    principal_group_cache.delete(user_id)
+
+
+def _get_token_memo(name: str, build):
+    """
+    Value built once per JWT of the current request.
+    flask_jwt_extended keeps the JWT on the app context, shared by every request served inside an outer
+    app context (tests, scripts), so the value is kept next to the JWT it was built from and rebuilt
+    when another JWT was verified since.
+    """
+    top = _app_ctx_stack.top
+    jwt_data = getattr(top, 'jwt', None)
+    memo = getattr(top, name, None)
+    if memo is not None and memo[0] is jwt_data:
+        return memo[1]
+    value = build(jwt_data or {})
+    setattr(top, name, (jwt_data, value))
+    return value
+
+
+def _build_principal(jwt_data: dict):
+    if not jwt_data:
+        return None
+    user_id = jwt_data.get('identity')
+    claims = jwt_data.get(permission_registry.claims_key) or {}
+    group_id = claims.get('group_id')
+    if group_id is None:
+        group_id = principal_group_cache.get(user_id)
+        if group_id is None:
+            group_id = User.get_group_id(user_id)
+            principal_group_cache.set(user_id, group_id)
+    return Principal(user_id, group_id, claims.get('permission_version'))
+
+
+def get_current_principal():
+    """
+    Principal of the current request, built once per request from the JWT claims.
+    Tokens without the group_id claim cost one cached query on User.group_id.
+    Returns:
+        Principal or None when the request has no verified JWT
+    """
+    return _get_token_memo('jwt_principal', _build_principal)
+
+
+current_principal = LocalProxy(get_current_principal)
+
+
+def _build_permissions(jwt_data: dict):
+    claims = jwt_data.get(permission_registry.claims_key, {})
+    bitmap = claims.get("permission_bitmap")
+    if bitmap is not None and claims.get("permission_version") == permission_registry.version:
+        return permission_registry.decode(bitmap)
+    if bitmap is not None:
+        # Routes changed since the token was issued
+        return get_group_permissions(get_current_principal().group_id)
+    return frozenset(claims.get("list_permission") or ())
+
+
+def get_request_permissions():
+    """
+    Permissions of the current token, decoded once per request:
+    an int bitmap over permission_registry or a frozenset of resources.
+    Tokens issued before the bitmap claims carry the full "list_permission" and are still accepted.
+    """
+    return _get_token_memo('jwt_permissions', _build_permissions)
+
+
+def has_permission(permission_route: str) -> bool:
+    """
+    Check a permission resource like "get@/api/v1/admin/users" for the current request
+    """
+    permissions = get_request_permissions()
+    if isinstance(permissions, int):
+        position = permission_registry.index.get(permission_route)
+        return position is not None and bool(permissions >> position & 1)
+    return permission_route in permissions
+
+
+def _has_endpoint_permission(endpoint: str, method: str) -> bool:
+    permission = permission_registry.endpoints.get((endpoint, method))
+    if permission is None:
+        return False
+    permissions = get_request_permissions()
+    if isinstance(permissions, int):
+        return bool(permissions >> permission[1] & 1)
+    return permission[0] in permissions
+
+
+def _get_header_token():
+    """
+    Encoded access token of the Authorization header, None when it can not be read without the full parser
+    """
+    if tuple(jwt_config.token_location) != ('headers',):
+        return None
+    parts = request.headers.get(jwt_config.header_name, '').split()
+    if jwt_config.header_type:
+        if len(parts) != 2 or parts[0] != jwt_config.header_type:
+            return None
+        return parts[1]
+    return parts[0] if len(parts) == 1 else None
+
+
+def verify_jwt_in_request_cached():
+    """
+    verify_jwt_in_request, reusing the claims of a token this worker already verified.
+    A cached token is still checked against the blacklist on every request.
+    """
+    if not verified_token_cache.enabled or request.method in jwt_config.exempt_methods:
+        return verify_jwt_in_request()
+    encoded_token = _get_header_token()
+    if encoded_token is None:
+        return verify_jwt_in_request()
+    top = _app_ctx_stack.top
+    cached = verified_token_cache.get(encoded_token)
+    if cached is None:
+        verify_jwt_in_request()
+        verified_token_cache.set(encoded_token, top.jwt, top.jwt_header)
+        return
+    jwt_data, jwt_header = cached
+    verify_token_not_blacklisted(jwt_data, 'access')
+    top.jwt = jwt_data
+    top.jwt_header = jwt_header
+    verify_token_claims(jwt_data)
 
 
 def authorization_require():
@@ -19,15 +249,13 @@ def authorization_require():
     def wrapper(fn):
         @wraps(fn)
         def decorator(*args, **kwargs):
-            verify_jwt_in_request()
-            permission_route = "{0}@{1}".format(request.method.lower(), request.url_rule.rule)
-            claims = get_jwt_claims()
+            verify_jwt_in_request_cached()
+            claims = get_request_claims()
 
             if claims.get("force_change_password"):
                 return send_error(message='You have to change your password before do this action')
 
-            list_permission = claims.get("list_permission")
-            if permission_route in list_permission:
+            if _has_endpoint_permission(request.url_rule.endpoint, request.method):
                 return fn(*args, **kwargs)
             else:
                 return send_error(message='You do not have permission')
@@ -0,0 +1,370 @@
+import threading
+import time
+import urllib
+
+from marshmallow import ValidationError
+from sqlalchemy import select, func, bindparam, and_, or_, text, inspect
+from sqlalchemy.dialects.mysql import match
+
+from app.extensions import db, count_cache
+from app.models import Question, User, UserTrigram
+from app.utils import escape_wildcard, encode_cursor, fold_text, get_trigrams, OffsetPage, \
+    KeysetPage
+
+
+class FullTextIndex(object):
+    """
+    MySQL FULLTEXT index over columns of a model. ListQuery searches with MATCH ... AGAINST and ranks by
+    relevance when the index exists, with LIKE otherwise (other databases, index not created yet).
+    A search index provides is_available(), bind(search_name), criterion(variant) and rank(variant).
+
+    Args:
+        name: name of the index
+        model:
+        columns: indexed columns, in the order of the index
+        check_interval: seconds between two checks that the index exists
+        min_word_length: ngram_token_size of the server
+    """
+
+    def __init__(self, name: str, model, columns, check_interval: int = 300, min_word_length: int = 2):
+        self.name = name
+        self.model = model
+        self.columns = tuple(columns)
+        self.check_interval = check_interval
+        self.min_word_length = min_word_length
+        self._available = False
+        self._checked_at = None
+
+    def is_available(self) -> bool:
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at > self.check_interval:
+            self._available = self._check()
+            self._checked_at = now
+        return self._available
+
+    def _check(self) -> bool:
+        connection = db.session.connection()
+        if connection.dialect.name != 'mysql':
+            return False
+        rows = connection.execute(text("SELECT COLUMN_NAME FROM information_schema.STATISTICS "
+                                       "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name "
+                                       "AND INDEX_NAME = :index_name AND INDEX_TYPE = 'FULLTEXT'"),
+                                  dict(table_name=self.model.__tablename__, index_name=self.name)).fetchall()
+        return {row[0] for row in rows} == {column.key for column in self.columns}
+
+    def bind(self, search_name: str):
+        """
+        The search is one quoted phrase in boolean mode: its ngrams must follow each other, close to the
+        LIKE '%search%' it replaces. In natural language mode any shared ngram would match.
+        Returns:
+            (variant of the statement, values of its bind parameters), None to search with LIKE when a
+            word is shorter than the ngram size, the ngram parser ignores it
+        """
+        words = search_name.replace('"', ' ').split()
+        if not words or min(len(word) for word in words) < self.min_word_length:
+            return None
+        return None, {'search': '"{}"'.format(' '.join(words))}
+
+    def criterion(self, variant):
+        return match(*self.columns, against=bindparam('search')).in_boolean_mode()
+
+    def rank(self, variant):
+        return self.criterion(variant)
+
+
+class TrigramIndex(object):
+    """
+    Accent-insensitive substring search on User.search_name through the user_trigram table.
+    Words of 3+ letters are searched anywhere, 2 letters only as the prefix of a word (autocomplete),
+    a single letter is only checked on the users found by the other words.
+
+    Args:
+        max_words: words of the search used by the index, the longest ones are kept
+        check_interval: seconds between two checks that every user is indexed
+    """
+
+    def __init__(self, max_words: int = 4, check_interval: int = 300):
+        self.max_words = max_words
+        self.check_interval = check_interval
+        self._available = False
+        self._checked_at = None
+
+    def is_available(self) -> bool:
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at > self.check_interval:
+            self._available = self._check()
+            self._checked_at = now
+        return self._available
+
+    def _check(self) -> bool:
+        if not inspect(db.session.connection()).has_table(UserTrigram.__tablename__):
+            return False
+        # users created before the index have no search_name until User.rebuild_search_index runs
+        return db.session.query(User.id).filter(User.search_name.is_(None)).first() is None
+
+    def bind(self, search_name: str):
+        words = sorted(set(fold_text(search_name).split()), key=len, reverse=True)[:self.max_words]
+        trigrams = set()
+        for word in words:
+            if len(word) >= 3:
+                trigrams |= {trigram for trigram in get_trigrams(word) if ' ' not in trigram}
+            elif len(word) == 2:
+                trigrams.add(' ' + word)
+        if not trigrams:
+            return None
+        values = dict(trigrams=sorted(trigrams), trigram_count=len(trigrams))
+        variant = []
+        for i, word in enumerate(words):
+            values['word_{}'.format(i)] = escape_wildcard(word)
+            variant.append('prefix' if len(word) == 2 else 'contains')
+        return tuple(variant), values
+
+    def criterion(self, variant):
+        candidates = select(UserTrigram.user_id) \
+            .where(UserTrigram.trigram.in_(bindparam('trigrams', expanding=True))) \
+            .group_by(UserTrigram.user_id) \
+            .having(func.count() == bindparam('trigram_count'))
+        criteria = [User.id.in_(candidates)]
+        for i, kind in enumerate(variant):
+            word = bindparam('word_{}'.format(i))
+            if kind == 'prefix':
+                criteria.append(or_(User.search_name.like(word + '%'), User.search_name.like('% ' + word + '%')))
+            else:
+                criteria.append(User.search_name.like('%' + word + '%'))
+        return and_(*criteria)
+
+    def rank(self, variant):
+        return None
+
+
+class ListQuery(object):
+    """
+    Declarative query of an admin list endpoint: search, created date range, filters, sort and pagination.
+    Statements are built once per shape (which optional parts are used, sort, pagination mode) with bind
+    parameters, then only executed with the values of the request.
+
+    Args:
+        name: name of the endpoint in the timing stats
+        model: listed model, it must have an id column
+        search_columns: columns matched by search_name with LIKE
+        sort_columns: names of the columns clients may sort on, they should be indexed
+        filters: request param -> column (equality) or callable(bind parameter) returning a criterion
+        date_column: column of the from_date/to_date range, None when the list has no date range, the range has no
+            upper bound when to_date is not given
+        default_sort: sort column when sort_by is not given
+        search_index: FullTextIndex or TrigramIndex used instead of LIKE when it is available, results are
+            ranked when the index can rank them and sort_by is not given
+    """
+    registry = {}
+
+    def __init__(self, name: str, model, search_columns=(), sort_columns=('created_date',),
+                 filters: dict = None, date_column='created_date', default_sort: str = 'created_date',
+                 search_index=None):
+        self.name = name
+        self.model = model
+        self.search_columns = tuple(search_columns)
+        self.sort_columns = {sort: getattr(model, sort) for sort in set(sort_columns) | {default_sort}}
+        self.filters = filters or {}
+        self.date_column = getattr(model, date_column) if date_column else None
+        self.default_sort = default_sort
+        self.search_index = search_index
+        self._statements = {}
+        self._lock = threading.Lock()
+        self._stats = dict(calls=0, total_ms=0.0, max_ms=0.0, last_ms=0.0)
+        ListQuery.registry[name] = self
+
+    def _criteria(self, search, filters: tuple, to_date: bool) -> list:
+        criteria = []
+        if isinstance(search, tuple):
+            criteria.append(self.search_index.criterion(search[1]))
+        elif search == 'like':
+            pattern = bindparam('search')
+            criteria.append(or_(*[column.like(pattern) for column in self.search_columns]))
+        if self.date_column is not None:
+            criteria.append(self.date_column > bindparam('from_date'))
+            if to_date:
+                criteria.append(self.date_column < bindparam('to_date'))
+        for name in filters:
+            spec = self.filters[name]
+            if hasattr(spec, '__clause_element__'):
+                criteria.append(spec == bindparam(name))
+            else:
+                criteria.append(spec(bindparam(name)))
+        return criteria
+
+    def _build(self, shape: tuple):
+        search, filters, sort_by, order_by, mode, to_date = shape
+        criteria = self._criteria(search, filters, to_date)
+        id_column = self.model.id
+        statement = select(self.model).where(*criteria)
+        if sort_by is None:
+            # most relevant first
+            statement = statement.order_by(self.search_index.rank(search[1]).desc(), id_column.desc()) \
+                .limit(bindparam('limit')).offset(bindparam('offset'))
+            count_statement = select(func.count()).select_from(self.model).where(*criteria)
+            return statement, count_statement, count_cache.get_tables(count_statement)
+        column = self.sort_columns[sort_by]
+        if mode == 'offset':
+            # same order as before: no id tie-breaker
+            statement = statement.order_by(column.asc() if order_by == 'asc' else column.desc()) \
+                .limit(bindparam('limit')).offset(bindparam('offset'))
+            count_statement = select(func.count()).select_from(self.model).where(*criteria)
+            return statement, count_statement, count_cache.get_tables(count_statement)
+        value, row_id = bindparam('cursor_value'), bindparam('cursor_id')
+        if order_by == 'asc':
+            statement = statement.order_by(column.asc(), id_column.asc())
+            if mode == 'seek_null':
+                statement = statement.where(or_(column.isnot(None), and_(column.is_(None), id_column > row_id)))
+            elif mode == 'seek':
+                statement = statement.where(or_(column > value, and_(column == value, id_column > row_id)))
+        else:
+            # NULL values come last in desc, like MySQL orders them
+            statement = statement.order_by(column.desc(), id_column.desc())
+            if mode == 'seek_null':
+                statement = statement.where(column.is_(None), id_column < row_id)
+            elif mode == 'seek':
+                statement = statement.where(or_(column < value, and_(column == value, id_column < row_id),
+                                                column.is_(None)))
+        return statement.limit(bindparam('limit')), None, ()
+
+    def _get_statements(self, shape: tuple):
+        statements = self._statements.get(shape)
+        if statements is None:
+            with self._lock:
+                statements = self._statements.get(shape)
+                if statements is None:
+                    statements = self._statements[shape] = self._build(shape)
+        return statements
+
+    def _prepare(self, params: dict):
+        """
+        Returns:
+            (shape, values of the bind parameters, page_size)
+        """
+        sort_by = params.get('sort_by') or self.default_sort
+        if sort_by not in self.sort_columns:
+            raise ValidationError({'sort_by': ['Must be one of: {}.'.format(', '.join(sorted(self.sort_columns)))]})
+        order_by = params.get('order_by', 'desc')
+        page_size = params.get('page_size', 15)
+        if page_size <= 0:
+            raise ValidationError({'page_size': ['page_size needs to be >= 1']})
+        cursor = params.get('cursor', None)
+
+        values = {}
+        search = None
+        search_name = params.get('search_name', '')
+        search_name = urllib.parse.unquote(search_name, encoding='utf-8', errors='replace').strip()
+        bound = None
+        if search_name and self.search_index is not None and self.search_index.is_available():
+            bound = self.search_index.bind(search_name)
+        if bound is not None:
+            search = ('index', bound[0])
+            values.update(bound[1])
+        elif search_name and self.search_columns:
+            search = 'like'
+            values['search'] = "%{}%".format(escape_wildcard(search_name))
+        if self.date_column is not None:
+            values['from_date'] = params.get('from_date', 0)
+            # without to_date the bound was "now", which changed every second and so did the count cache key
+            if params.get('to_date') is not None:
+                values['to_date'] = params['to_date']
+        filters = tuple(sorted(name for name in self.filters if params.get(name) not in (None, '')))
+        for name in filters:
+            values[name] = params[name]
+
+        if cursor is None:
+            mode = 'offset'
+        elif not cursor:
+            mode = 'first'
+        else:
+            mode = 'seek_null' if cursor[0] is None else 'seek'
+            values['cursor_value'], values['cursor_id'] = cursor
+        if search and search != 'like' and mode == 'offset' and not params.get('sort_by') \
+                and self.search_index.rank(search[1]) is not None:
+            sort_by = None
+        return (search, filters, sort_by, order_by, mode, 'to_date' in values), values, page_size
+
+    def execute(self, params: dict):
+        """
+        Args:
+            params: request params loaded by the Get*Validation schema of the endpoint
+        Returns:
+            OffsetPage, or KeysetPage when a cursor is given
+        Raises:
+            ValidationError: sort_by is not a sortable column, page or page_size < 1
+        """
+        started_at = time.perf_counter()
+        shape, values, page_size = self._prepare(params)
+        sort_by, mode = shape[2], shape[4]
+        statement, count_statement, tables = self._get_statements(shape)
+
+        if mode == 'offset':
+            paginator = self._paginate(statement, count_statement, tables, shape, values,
+                                       params.get('page', 1), page_size, params.get('total', 'exact'))
+        else:
+            items = db.session.execute(statement, dict(values, limit=page_size + 1)).scalars().all()
+            next_cursor = None
+            if len(items) > page_size:
+                items = items[:page_size]
+                next_cursor = encode_cursor(getattr(items[-1], sort_by), items[-1].id)
+            paginator = KeysetPage(items, next_cursor)
+        self._record(time.perf_counter() - started_at)
+        return paginator
+
+    def explain(self, params: dict) -> list:
+        """
+        MySQL plan of the page statement execute() runs for params
+        Returns:
+            EXPLAIN rows as dicts
+        """
+        shape, values, page_size = self._prepare(params)
+        statement = self._get_statements(shape)[0]
+        values = dict(values, limit=page_size, offset=0)
+        connection = db.session.connection()
+        if connection.dialect.name != 'mysql':
+            raise ValueError('EXPLAIN is only supported on MySQL')
+        compiled = statement.params(values).compile(dialect=connection.dialect,
+                                                    compile_kwargs={'render_postcompile': True})
+        compiled_params = compiled.construct_params()
+        parameters = tuple(compiled_params[name] for name in compiled.positiontup)
+        return [dict(row) for row in connection.exec_driver_sql('EXPLAIN ' + compiled.string, parameters).mappings()]
+
+    def _paginate(self, statement, count_statement, tables, shape, values, page, page_size, total):
+        if page <= 0:
+            raise ValidationError({'page': ['page needs to be >= 1']})
+        offset = (page - 1) * page_size
+        if total == 'none':
+            items = db.session.execute(statement, dict(values, limit=page_size + 1, offset=offset)).scalars().all()
+            return OffsetPage(items[:page_size], page, page_size, has_next=len(items) > page_size)
+        items = db.session.execute(statement, dict(values, limit=page_size, offset=offset)).scalars().all()
+        connection = db.session.connection()
+        if total == 'approx' and connection.dialect.name == 'mysql':
+            count = count_cache.get_or_count((self.name, 'estimate') + shape, values, tables,
+                                             lambda: count_cache.explain(connection, count_statement, values))
+            return OffsetPage(items, page, page_size, count, estimated=True)
+        count = count_cache.get_or_count((self.name, 'count') + shape, values, tables,
+                                         lambda: db.session.execute(count_statement, values).scalar())
+        return OffsetPage(items, page, page_size, count)
+
+    def _record(self, duration: float):
+        duration_ms = duration * 1000
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['total_ms'] += duration_ms
+            self._stats['max_ms'] = max(self._stats['max_ms'], duration_ms)
+            self._stats['last_ms'] = duration_ms
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            "calls": stats['calls'],
+            "avg_ms": round(stats['total_ms'] / (stats['calls'] or 1), 3),
+            "max_ms": round(stats['max_ms'], 3),
+            "last_ms": round(stats['last_ms'], 3),
+            "statements": len(self._statements)
+        }
+
+
+question_fulltext = FullTextIndex('ft_question_title_description', Question, [Question.title, Question.description])
+user_trigram_index = TrigramIndex()
@@ -0,0 +1,263 @@
+from collections import defaultdict
+
+from marshmallow import fields, missing
+from marshmallow.utils import get_value
+from sqlalchemy import inspect
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.cache import TTLCache
+from app.extensions import db
+from app.models import User, Group, Role, RolePermission, Permission, GroupRole, TopicQuestion, Question, Comment
+
+
+class Reference(object):
+    """
+    Many-to-one value read through an id attribute, ex: Question.creator is User.get_by_id(question.creator_id).
+    User.get_by_id and many-to-one relationships read the session identity map first, so loading the
+    referenced rows beforehand removes one query per row.
+
+    Args:
+        key: id attribute of the referencing object
+        model: referenced model
+    """
+
+    def __init__(self, key: str, model):
+        self.key = key
+        self.model = model
+
+
+class Collection(object):
+    """
+    One-to-many relationship, loaded for many parents with one IN query on the foreign key.
+
+    Args:
+        attribute: relationship attribute of the parent
+        model: child model
+        key: foreign key of the child to the parent id
+        references: Reference of the children, loaded after them
+    """
+
+    def __init__(self, attribute: str, model, key: str, references: dict = None):
+        self.attribute = attribute
+        self.model = model
+        self.key = key
+        self.references = references or {}
+
+
+# attribute dumped by a schema -> how to batch load it, per model
+# creator, assignee_user and user are dumped by UserSummaryField instead
+RELATIONS = {
+    User: {'creator': Reference('creator_id', User), 'group': Reference('group_id', Group)},
+    Role: {'permissions': Collection('role_permissions', RolePermission, 'role_id',
+                                     {'permission': Reference('permission_id', Permission)})},
+    Group: {'roles': Collection('group_roles', GroupRole, 'group_id', {'role': Reference('role_id', Role)})},
+    Question: {'topic': Reference('topic_id', TopicQuestion)},
+    Comment: {'sender': Reference('sender_id', User)},
+}
+
+
+class UserSummary(object):
+    """
+    The fields of a user nested in other responses
+    """
+    __slots__ = ('id', 'email', 'first_name', 'last_name', 'avatar_url')
+
+    def __init__(self, _id: str, email: str, first_name: str, last_name: str, avatar_url: str):
+        self.id = _id
+        self.email = email
+        self.first_name = first_name
+        self.last_name = last_name
+        self.avatar_url = avatar_url
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "email": self.email, "first_name": self.first_name, "last_name": self.last_name,
+                "avatar_url": self.avatar_url}
+
+
+class UserSummaryCache(object):
+    """
+    LRU of UserSummary by user id, loaded with one query on the five columns instead of User rows.
+    Unknown ids are cached too, as None. update_user and delete_user invalidate the entries of this worker,
+    other workers see the change after the TTL.
+
+    Config:
+        USER_SUMMARY_CACHE_SIZE: max users per worker
+        USER_SUMMARY_CACHE_TTL: max seconds a summary is trusted
+    """
+    _UNKNOWN = ()
+
+    def __init__(self, app=None):
+        self._cache = TTLCache(max_size=10000, ttl=300)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._cache = TTLCache(max_size=app.config.get('USER_SUMMARY_CACHE_SIZE', 10000),
+                               ttl=app.config.get('USER_SUMMARY_CACHE_TTL', 300))
+
+    def load_many(self, ids) -> dict:
+        """
+        Returns:
+            user id -> UserSummary or None, the missing ids are loaded with one IN query
+        """
+        summaries = {}
+        missing = []
+        for _id in set(ids):
+            summary = self._cache.get(_id)
+            if summary is None:
+                missing.append(_id)
+            else:
+                summaries[_id] = summary
+        if missing:
+            rows = db.session.query(User.id, User.email, User.first_name, User.last_name, User.avatar_url) \
+                .filter(User.id.in_(missing)).all()
+            for row in rows:
+                summaries[row.id] = UserSummary(*row)
+            for _id in missing:
+                self._cache.set(_id, summaries.setdefault(_id, self._UNKNOWN))
+        return {_id: summary or None for _id, summary in summaries.items()}
+
+    def get(self, _id: str):
+        """
+        Returns:
+            UserSummary or None when the user does not exist
+        """
+        if _id is None:
+            return None
+        return self.load_many([_id])[_id]
+
+    def invalidate(self, _id: str):
+        self._cache.delete(_id)
+
+    def clear(self):
+        self._cache.clear()
+
+
+user_summaries = UserSummaryCache()
+
+
+class UserSummaryField(fields.Field):
+    """
+    Dumps the UserSummary of the user whose id is in the key attribute, same output as
+    Nested(UserSchema(only=['id', 'email', "first_name", "last_name", "avatar_url"])) on the user.
+    prefetch loads the summaries of a whole page at once.
+
+    Args:
+        key: id attribute of the dumped object, ex: creator_id
+    """
+
+    def __init__(self, key: str, **kwargs):
+        super().__init__(dump_only=True, **kwargs)
+        self.key = key
+
+    def get_value(self, obj, attr, accessor=None, default=missing):
+        return get_value(obj, self.key, default)
+
+    def _serialize(self, value, attr, obj, **kwargs):
+        summary = user_summaries.get(value)
+        return None if summary is None else summary.to_dict()
+
+
+def _is_loaded(model, _id) -> bool:
+    instance = db.session.identity_map.get(inspect(model).identity_key_from_primary_key([_id]))
+    return instance is not None and not inspect(instance).expired_attributes
+
+
+def load_references(ids_by_model: dict) -> list:
+    """
+    Load the rows of every model whose ids are not in the session yet, one IN query per model
+    Returns:
+        loaded rows, the identity map only keeps the rows something else references
+    """
+    loaded = []
+    for model, ids in ids_by_model.items():
+        missing = [_id for _id in ids if not _is_loaded(model, _id)]
+        if missing:
+            loaded.extend(model.query.filter(inspect(model).primary_key[0].in_(missing)).all())
+    return loaded
+
+
+def load_collection(collection: Collection, parents: list) -> list:
+    parents = [parent for parent in parents if collection.attribute in inspect(parent).unloaded]
+    if not parents:
+        return []
+    children = defaultdict(list)
+    foreign_key = getattr(collection.model, collection.key)
+    for child in collection.model.query.filter(foreign_key.in_({parent.id for parent in parents})):
+        children[getattr(child, collection.key)].append(child)
+    for parent in parents:
+        set_committed_value(parent, collection.attribute, children.get(parent.id, []))
+    ids_by_model = defaultdict(set)
+    for reference in collection.references.values():
+        for items in children.values():
+            ids_by_model[reference.model].update(getattr(child, reference.key) for child in items
+                                                 if getattr(child, reference.key) is not None)
+    return load_references(ids_by_model)
+
+
+def get_nested_schema(field):
+    if isinstance(field, fields.Nested):
+        return field.schema
+    if isinstance(field, fields.List) and isinstance(field.inner, fields.Nested):
+        return field.inner.schema
+    return None
+
+
+def prefetch(schema, objects: list) -> list:
+    """
+    Load what the nested fields of a schema will read on objects: one IN query per referenced model and
+    per collection, level by level, instead of one query per row and per field. The user summaries of
+    every level are loaded at the end, with one IN query.
+
+    Args:
+        schema: marshmallow schema about to dump the objects, only= is honoured
+        objects: model instances
+    Returns:
+        loaded rows, to keep referenced until the dump is over
+    """
+    loaded = []
+    summary_ids = set()
+    _prefetch(schema, objects, loaded, summary_ids)
+    if summary_ids:
+        user_summaries.load_many(summary_ids)
+    return loaded
+
+
+def _prefetch(schema, objects: list, loaded: list, summary_ids: set):
+    objects = [obj for obj in objects if obj is not None]
+    for field in schema.dump_fields.values():
+        if isinstance(field, UserSummaryField):
+            summary_ids.update(value for value in (get_value(obj, field.key) for obj in objects)
+                               if value not in (None, missing))
+    nested = []
+    for field_name, field in schema.dump_fields.items():
+        nested_schema = get_nested_schema(field)
+        if nested_schema is not None:
+            nested.append((field.attribute or field_name, nested_schema))
+    if not nested:
+        return
+    by_model = defaultdict(list)
+    for obj in objects:
+        if type(obj) in RELATIONS:
+            by_model[type(obj)].append(obj)
+    for model, items in by_model.items():
+        relations = [RELATIONS[model][name] for name, _ in nested if name in RELATIONS[model]]
+        ids_by_model = defaultdict(set)
+        for relation in relations:
+            if isinstance(relation, Reference):
+                ids_by_model[relation.model].update(getattr(item, relation.key) for item in items
+                                                    if getattr(item, relation.key) is not None)
+        loaded.extend(load_references(ids_by_model))
+        for relation in relations:
+            if isinstance(relation, Collection):
+                loaded.extend(load_collection(relation, items))
+    # nested fields without a relation are read as they will be dumped, their own nested fields are batched
+    for name, nested_schema in nested:
+        values = []
+        for obj in objects:
+            value = get_value(obj, name, None)
+            if isinstance(value, list):
+                values.extend(value)
+            else:
+                values.append(value)
+        _prefetch(nested_schema, values, loaded, summary_ids)
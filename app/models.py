@@ -1,13 +1,14 @@
 # coding: utf-8
 import uuid
 
+from flask import current_app
 from flask_jwt_extended import decode_token, get_raw_jwt
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, event, inspect, select, func
 from sqlalchemy.dialects.mysql import INTEGER
 from sqlalchemy.orm import relationship
 from sqlalchemy import or_, and_
-from app.extensions import db
-from app.utils import get_timestamp_now
+from app.extensions import db, revoked_store, verified_token_cache
+from app.utils import get_timestamp_now, fold_text, get_trigrams
 
 Base = db.Model
 session = db.session
@@ -22,11 +23,11 @@ class Token(db.Model):
     __tablename__ = 'token'
 
     id = db.Column(db.String(50), primary_key=True)
-    jti = db.Column(db.String(36), nullable=False)
+    jti = db.Column(db.String(36), nullable=False, index=True)
     token_type = db.Column(db.String(10), nullable=False)
     user_identity = db.Column(db.String(50), nullable=False)
     revoked = db.Column(db.Boolean, nullable=False)
-    expires = db.Column(INTEGER(unsigned=True), nullable=False)
+    expires = db.Column(INTEGER(unsigned=True), nullable=False, index=True)
 
     @staticmethod
     def add_token_to_database(encoded_token, user_identity):
@@ -52,6 +53,7 @@ class Token(db.Model):
         )
         db.session.add(db_token)
         db.session.commit()
+        revoked_store.set_revoked(jti, revoked, expires)
 
     @staticmethod
     def is_token_revoked(decoded_token):
@@ -60,12 +62,30 @@ class Token(db.Model):
         token that we create into this database, if the token is not present
         in the database we are going to consider it revoked, as we don't know where
         it was created.
+        The revocation cache is asked first, the database only on a cache miss.
         """
         jti = decoded_token['jti']
+        revoked = revoked_store.is_revoked(jti)
+        if revoked is not None:
+            return revoked
         token = Token.query.filter_by(jti=jti).first()
-        if token:
-            return token.revoked
-        return True
+        revoked = token.revoked if token else True
+        revoked_store.set_revoked(jti, revoked, decoded_token['exp'])
+        return revoked
+
+    @staticmethod
+    def is_token_epoch_stale(decoded_token):
+        """
+        In "epoch" revocation mode, a token is revoked when it was issued with a token_epoch
+        older than the current token_epoch of its user.
+        """
+        if current_app.config.get('TOKEN_REVOCATION_MODE', 'row') != 'epoch':
+            return False
+        user_claims = decoded_token.get('user_claims') or {}
+        current_epoch = User.get_token_epoch(decoded_token['identity'])
+        if current_epoch is None:
+            return True
+        return user_claims.get('token_epoch', 0) < current_epoch
 
     @staticmethod
     def revoke_token(jti):
@@ -76,7 +96,10 @@ class Token(db.Model):
         try:
             token = Token.query.filter_by(jti=jti).first()
             token.revoked = True
+            expires = token.expires
             db.session.commit()
+            revoked_store.set_revoked(jti, True, expires)
+            verified_token_cache.evict(jti)
         except Exception as ex:
             return str(ex)
 
@@ -89,17 +112,27 @@ class Token(db.Model):
         Args:
             users_identity: list or string, require
                 list user id or user_id. Used to query all token of the user on the database
+        In "epoch" revocation mode, it only bumps the token_epoch of the users.
         """
         try:
             if type(users_identity) is not list:
                 # convert user_id to list user_ids
                 users_identity = [users_identity]
 
+            if current_app.config.get('TOKEN_REVOCATION_MODE', 'row') == 'epoch':
+                User.bump_token_epoch(users_identity)
+                return
+
             tokens = Token.query.filter(Token.user_identity.in_(users_identity), Token.revoked == 0).all()
 
+            revoked_tokens = []
             for token in tokens:
                 token.revoked = True
+                revoked_tokens.append((token.jti, token.expires))
             db.session.commit()
+            for token_jti, expires in revoked_tokens:
+                revoked_store.set_revoked(token_jti, True, expires)
+                verified_token_cache.evict(token_jti)
         except Exception as ex:
             return str(ex)
 
@@ -111,28 +144,47 @@ class Token(db.Model):
         Set token Revoked flag is False to revoke this token.
         Args:
             users_identity: user id
+        The token rows are flagged in "epoch" revocation mode too: bumping the token_epoch would revoke the
+        current token as well.
         """
         jti = get_raw_jwt()['jti']
         try:
             tokens = Token.query.filter(Token.user_identity == users_identity, Token.revoked == 0,
                                         Token.jti != jti).all()
+            revoked_tokens = []
             for token in tokens:
                 token.revoked = True
+                revoked_tokens.append((token.jti, token.expires))
             db.session.commit()
+            for token_jti, expires in revoked_tokens:
+                revoked_store.set_revoked(token_jti, True, expires)
+                verified_token_cache.evict(token_jti)
         except Exception as ex:
             return str(ex)
 
     @staticmethod
-    def prune_database():
+    def prune_database(batch_size: int = 1000):
         """
         Delete tokens that have expired from the database.
-        How (and if) you call this is entirely up you. You could expose it to an
-        endpoint that only administrators could call, you could run it as a cron,
-        set it up with flask cli, etc.
+        Rows are deleted in batches of batch_size so a big backlog never holds long locks.
+        It runs in background every TOKEN_PRUNE_INTERVAL seconds (see register_token_pruner),
+        you can also call it from a cron or an admin endpoint.
+        Returns:
+            number of deleted rows
         """
         now_in_seconds = get_timestamp_now()
-        Token.query.filter(Token.expires < now_in_seconds).delete()
-        db.session.commit()
+        total = 0
+        while True:
+            token_ids = [row.id for row in db.session.query(Token.id).filter(Token.expires < now_in_seconds)
+                         .limit(batch_size).all()]
+            if not token_ids:
+                break
+            Token.query.filter(Token.id.in_(token_ids)).delete(synchronize_session=False)
+            db.session.commit()
+            total += len(token_ids)
+            if len(token_ids) < batch_size:
+                break
+        return total
 
 
 class Message(db.Model):
@@ -163,6 +215,10 @@ class User(db.Model):
     modified_date = db.Column(INTEGER(unsigned=True), default=0)
     group_id = db.Column(ForeignKey('group.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=True,
                          index=True)
+    # Tokens issued with an older epoch are revoked (TOKEN_REVOCATION_MODE = "epoch")
+    token_epoch = db.Column(INTEGER(unsigned=True), nullable=False, default=0, server_default='0')
+    # Names, username and email without diacritics, indexed by trigram in user_trigram
+    search_name = db.Column(db.String(400))
 
     group = relationship('Group', primaryjoin='User.group_id == Group.id')
 
@@ -174,12 +230,111 @@ class User(db.Model):
     def get_by_id(cls, _id):
         return cls.query.get(_id)
 
+    @classmethod
+    def get_group_id(cls, user_id: str):
+        return db.session.query(cls.group_id).filter(cls.id == user_id).scalar()
+
+    @classmethod
+    def get_token_epoch(cls, user_id: str):
+        """
+        Current token_epoch of a user, served from the revocation cache when possible
+        Returns:
+            token_epoch or None if the user does not exist
+        """
+        key = 'epoch:' + user_id
+        token_epoch = revoked_store.get(key)
+        if token_epoch is None:
+            token_epoch = db.session.query(cls.token_epoch).filter(cls.id == user_id).scalar()
+            if token_epoch is not None:
+                revoked_store.set(key, token_epoch)
+        return token_epoch
+
+    @classmethod
+    def bump_token_epoch(cls, user_ids: list):
+        """
+        Revoke every token of the users with a single UPDATE
+        """
+        cls.query.filter(cls.id.in_(user_ids)).update({cls.token_epoch: cls.token_epoch + 1},
+                                                      synchronize_session=False)
+        db.session.commit()
+        for user_id, token_epoch in db.session.query(cls.id, cls.token_epoch).filter(cls.id.in_(user_ids)).all():
+            revoked_store.set('epoch:' + user_id, token_epoch)
+
     @classmethod
     def check_user_exists(cls, keyword: str, user_id: str = None):
         if user_id:
             return cls.query.filter(and_(cls.id != user_id, or_(cls.email == keyword, cls.username == keyword))).first()
         return cls.query.filter(or_(cls.email == keyword, cls.username == keyword)).first()
 
+    def build_search_name(self) -> str:
+        values = [self.first_name, self.last_name, self.username, self.email]
+        return fold_text(' '.join(value for value in values if value))
+
+    @classmethod
+    def rebuild_search_index(cls, batch_size: int = 1000) -> int:
+        """
+        Fill search_name and user_trigram of every user, for users created before the index
+        Returns:
+            number of users
+        """
+        count = 0
+        last_id = ''
+        while True:
+            users = cls.query.filter(cls.id > last_id).order_by(cls.id).limit(batch_size).all()
+            if not users:
+                return count
+            for user in users:
+                search_name = user.build_search_name()
+                if user.search_name == search_name:
+                    UserTrigram.replace(db.session.connection(), user.id, search_name)
+                else:
+                    # indexed when flushed
+                    user.search_name = search_name
+            db.session.commit()
+            count += len(users)
+            last_id = users[-1].id
+
+
+class UserTrigram(db.Model):
+    """
+    Trigrams of User.search_name, used for accent-insensitive user search and autocomplete
+    """
+    __tablename__ = 'user_trigram'
+
+    trigram = db.Column(db.String(3), primary_key=True)
+    user_id = db.Column(ForeignKey('user.id', ondelete='CASCADE', onupdate='CASCADE'), primary_key=True,
+                        index=True)
+
+    @classmethod
+    def replace(cls, connection, user_id: str, search_name: str = None):
+        connection.execute(cls.__table__.delete().where(cls.user_id == user_id))
+        trigrams = set()
+        for token in (search_name or '').split():
+            trigrams |= get_trigrams(token)
+        if trigrams:
+            connection.execute(cls.__table__.insert(),
+                               [dict(trigram=trigram, user_id=user_id) for trigram in trigrams])
+
+
+@event.listens_for(User, 'before_insert')
+@event.listens_for(User, 'before_update')
+def _set_user_search_name(mapper, connection, target):
+    search_name = target.build_search_name()
+    if search_name != target.search_name:
+        target.search_name = search_name
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _index_user_search_name(mapper, connection, target):
+    if inspect(target).attrs.search_name.history.has_changes():
+        UserTrigram.replace(connection, target.id, target.search_name)
+
+
+@event.listens_for(User, 'after_delete')
+def _delete_user_trigrams(mapper, connection, target):
+    connection.execute(UserTrigram.__table__.delete().where(UserTrigram.user_id == target.id))
+
 
 class Permission(db.Model):
     __tablename__ = 'permission'
@@ -305,11 +460,32 @@ class TopicQuestion(db.Model):
     creator_id = db.Column(db.String(50), default="8dbd546c-6497-11ec-90d6-0242ac120003")  # Default admin
     created_date = db.Column(INTEGER(unsigned=True), default=get_timestamp_now(), index=True)
     modified_date = db.Column(INTEGER(unsigned=True), default=0)
+    # maintained by the Question mapper events, recomputed by repair_question_counts
+    question_count = db.Column(db.Integer, nullable=False, default=0)
     questions = relationship('Question', primaryjoin='TopicQuestion.id == Question.topic_id', viewonly=True)
 
     @property
     def number_of_questions(self):
-        return len(self.questions)
+        return self.question_count or 0
+
+    @classmethod
+    def change_question_count(cls, connection, topic_id: str, delta: int):
+        if topic_id:
+            connection.execute(cls.__table__.update().where(cls.id == topic_id)
+                               .values(question_count=cls.question_count + delta))
+
+    @classmethod
+    def repair_question_counts(cls) -> int:
+        """
+        Recompute question_count of every topic, for writes made around the ORM (SQL, bulk deletes)
+        Returns:
+            number of topics fixed
+        """
+        count = select(func.count(Question.id)).where(Question.topic_id == cls.id).scalar_subquery()
+        result = db.session.execute(cls.__table__.update().where(cls.question_count != count)
+                                    .values(question_count=count))
+        db.session.commit()
+        return result.rowcount
 
     @property
     def creator(self):
@@ -353,6 +529,19 @@ class Form(db.Model):
 
 class Question(db.Model):
     __tablename__ = 'question'
+    __table_args__ = (
+        # searched by ListQuery on MySQL, the ngram parser also splits short Vietnamese words
+        db.Index('ft_question_title_description', 'title', 'description', mysql_prefix='FULLTEXT',
+                 mysql_with_parser='ngram'),
+        # list filters followed by the created_date range and sort, see tests/test_query_plans.py
+        db.Index('ix_question_assignee_created', 'assignee_user_id', 'created_date'),
+        db.Index('ix_question_assignee_status_created', 'assignee_user_id', 'status', 'created_date'),
+        db.Index('ix_question_status_created', 'status', 'created_date'),
+        db.Index('ix_question_creator_created', 'creator_id', 'created_date'),
+        db.Index('ix_question_user_created', 'user_id', 'created_date'),
+        # check_question_exists
+        db.Index('ix_question_title', 'title'),
+    )
 
     id = db.Column(db.String(50), primary_key=True)
     start_time = db.Column(INTEGER(unsigned=True), default=get_timestamp_now(), index=True)
@@ -366,7 +555,7 @@ class Question(db.Model):
     attached_file_name = db.Column(db.String(255))
     assignee_user_id = db.Column(db.String(50))
     creator_id = db.Column(db.String(50), default="8dbd546c-6497-11ec-90d6-0242ac120003")  # Default admin
-    user_id = db.Column(ForeignKey('user.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False, index=True)
+    user_id = db.Column(ForeignKey('user.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
     topic_id = db.Column(ForeignKey('topic_question.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False,
                          index=True)
     topic = relationship('TopicQuestion', primaryjoin='Question.topic_id == TopicQuestion.id')
@@ -392,8 +581,68 @@ class Question(db.Model):
         return User.get_by_id(self.assignee_user_id)
 
 
+class QuestionParticipant(db.Model):
+    """
+    Users taking part in a question: its creator and its user. Maintained by the Question mapper events, so
+    "my questions" reads one primary key range instead of OR-ing creator_id and user_id.
+    """
+    __tablename__ = 'question_participant'
+
+    user_id = db.Column(ForeignKey('user.id', ondelete='CASCADE', onupdate='CASCADE'), primary_key=True)
+    question_id = db.Column(ForeignKey('question.id', ondelete='CASCADE', onupdate='CASCADE'), primary_key=True,
+                            index=True)
+
+    @classmethod
+    def replace(cls, connection, question_id: str, user_ids):
+        connection.execute(cls.__table__.delete().where(cls.question_id == question_id))
+        user_ids = {user_id for user_id in user_ids if user_id}
+        if user_ids:
+            connection.execute(cls.__table__.insert(),
+                               [dict(user_id=user_id, question_id=question_id) for user_id in user_ids])
+
+
+@event.listens_for(Question, 'after_insert')
+def _insert_question_participants(mapper, connection, target):
+    QuestionParticipant.replace(connection, target.id, [target.creator_id, target.user_id])
+
+
+@event.listens_for(Question, 'after_update')
+def _update_question_participants(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.creator_id.history.has_changes() or state.attrs.user_id.history.has_changes():
+        QuestionParticipant.replace(connection, target.id, [target.creator_id, target.user_id])
+
+
+@event.listens_for(Question, 'after_delete')
+def _delete_question_participants(mapper, connection, target):
+    connection.execute(QuestionParticipant.__table__.delete().where(QuestionParticipant.question_id == target.id))
+
+
+@event.listens_for(Question, 'after_insert')
+def _count_inserted_question(mapper, connection, target):
+    TopicQuestion.change_question_count(connection, target.topic_id, 1)
+
+
+@event.listens_for(Question, 'after_update')
+def _count_moved_question(mapper, connection, target):
+    history = inspect(target).attrs.topic_id.history
+    if history.has_changes():
+        for topic_id in history.deleted:
+            TopicQuestion.change_question_count(connection, topic_id, -1)
+        TopicQuestion.change_question_count(connection, target.topic_id, 1)
+
+
+@event.listens_for(Question, 'after_delete')
+def _count_deleted_question(mapper, connection, target):
+    TopicQuestion.change_question_count(connection, target.topic_id, -1)
+
+
 class History(db.Model):
     __tablename__ = 'history'
+    __table_args__ = (
+        # details of a question, sorted by created_date
+        db.Index('ix_history_question_created', 'question_id', 'created_date'),
+    )
 
     id = db.Column(db.String(50), primary_key=True)
     status = db.Column(db.SmallInteger, default=0)  # 1 - Đang xử lý, 0 - Khởi tạo , 2- Xử lý xong
@@ -403,8 +652,7 @@ class History(db.Model):
     modified_date = db.Column(INTEGER(unsigned=True), default=0)
     assignee_user_id = db.Column(db.String(50))
     creator_id = db.Column(db.String(50))
-    question_id = db.Column(ForeignKey('question.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False,
-                            index=True)
+    question_id = db.Column(ForeignKey('question.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
     question = relationship('Question', primaryjoin='History.question_id == Question.id')
 
     @property
@@ -551,13 +799,16 @@ class UserSubject(db.Model):
 # start comment
 class Comment(db.Model):
     __tablename__ = 'comment'
+    __table_args__ = (
+        # details of a question, sorted by created_date
+        db.Index('ix_comment_question_created', 'question_id', 'created_date'),
+    )
 
     id = db.Column(db.String(50), primary_key=True)
     message = db.Column(db.TEXT)
     sender_id = db.Column(ForeignKey('user.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False,
                           index=True)
-    question_id = db.Column(ForeignKey('question.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False,
-                            index=True)
+    question_id = db.Column(ForeignKey('question.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
     attached_file_url = db.Column(db.String(255))
     attached_file_name = db.Column(db.String(255))
     created_date = db.Column(INTEGER(unsigned=True), default=get_timestamp_now(), index=True)
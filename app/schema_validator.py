@@ -1,8 +1,12 @@
-from marshmallow import Schema, fields, validate, pre_load, validates, ValidationError, validates_schema
+import threading
+
+from marshmallow import Schema, fields, validate, pre_load, ValidationError, validates_schema, EXCLUDE
 
 from app.enums import LIST_GROUP
+from app.loader import prefetch, get_nested_schema, UserSummaryField
 from app.models import User, Role, Group, TopicQuestion, Subject, FrequentQuestion, Form, Question
-from app.utils import REGEX_EMAIL
+from app.serializer import CompiledSchema
+from app.utils import REGEX_EMAIL, decode_cursor
 
 """
 Author: TienNguyen
@@ -10,6 +14,134 @@ CreatedDate: 15/01/2022
 """
 
 
+class CursorField(fields.String):
+    """
+    Opaque keyset pagination cursor, loaded as (sort_value, id), () for the first page
+    """
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        value = super()._deserialize(value, attr, data, **kwargs)
+        try:
+            return decode_cursor(value)
+        except ValueError:
+            raise ValidationError('Invalid cursor')
+
+
+class FieldsetField(fields.String):
+    """
+    Comma separated field names, loaded as a tuple, ex: "id,title,topic.name"
+    """
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        value = super()._deserialize(value, attr, data, **kwargs)
+        names = tuple(name.strip() for name in value.split(',') if name.strip())
+        if not names:
+            raise ValidationError('At least one field name is required')
+        return names
+
+
+def _is_relation(field) -> bool:
+    return isinstance(field, UserSummaryField) or get_nested_schema(field) is not None
+
+
+def _get_field(schema, path: str, param: str):
+    """
+    Returns:
+        dumped field of a dotted path, ex: topic.name
+    Raises:
+        ValidationError: unknown field, marshmallow ignores unknown nested names of only=
+    """
+    field = None
+    nested = schema
+    for name in path.split('.'):
+        field = nested.dump_fields.get(name) if nested is not None else None
+        if field is None:
+            raise ValidationError({param: ['Unknown field: {}'.format(path)]})
+        nested = get_nested_schema(field)
+    return field
+
+
+def _expand_relation(schema, path: str) -> list:
+    """
+    Returns:
+        names to add to only= to dump a relation, ex: topic -> topic.id, topic.name, ... without topic.creator
+    """
+    field = _get_field(schema, path, 'include')
+    if not _is_relation(field):
+        raise ValidationError({'include': ['Unknown relation: {}'.format(path)]})
+    nested = get_nested_schema(field)
+    if nested is None:
+        return [path]
+    return ['{}.{}'.format(path, name) for name, field in nested.dump_fields.items() if not _is_relation(field)]
+
+
+def get_fieldset(schema_class, params: dict):
+    """
+    only= of a dump schema from the fields and include request params. A relation is only dumped, and so
+    only loaded, when it is requested.
+        fields: dumped fields, every field but the relations when only include is given, ex: id,title,status
+        include: relations added with their own fields, ex: creator,topic.creator
+    Returns:
+        field names, None when neither param is given
+    Raises:
+        ValidationError: unknown field or relation, empty fields
+    """
+    fieldset, include = params.get('fieldset'), params.get('include')
+    if fieldset is None and include is None:
+        return None
+    # only the fields are read, the shared instance of get_validator does
+    schema = get_validator(schema_class)
+    if fieldset is None:
+        only = {name for name, field in schema.dump_fields.items() if not _is_relation(field)}
+    else:
+        if not fieldset:
+            raise ValidationError({'fields': ['At least one field name is required']})
+        only = set(fieldset)
+        for path in only:
+            _get_field(schema, path, 'fields')
+    for path in include or ():
+        # topic.creator also dumps the fields of topic
+        names = path.split('.')
+        for depth in range(1, len(names) + 1):
+            only.update(_expand_relation(schema, '.'.join(names[:depth])))
+    return sorted(only)
+
+
+class PrefetchSchema(Schema):
+    """
+    Schema batch loading the rows its nested fields read before dumping, see app.loader.prefetch.
+    Nested schema instances are shared by every thread, the loaded rows are only held by the dump call.
+    """
+
+    def dump(self, obj, *, many: bool = None):
+        many = self.many if many is None else bool(many)
+        loaded = prefetch(self, obj if many else [obj])
+        data = super().dump(obj, many=many)
+        # the prefetched rows stay referenced until the dump is over
+        del loaded
+        return data
+
+
+_validators = {}
+_validators_lock = threading.Lock()
+
+
+def get_validator(schema_class) -> Schema:
+    """
+    Shared instance of a request validator, built once per worker instead of on every request.
+    load() and validate() keep their state in local variables, so one instance serves every thread.
+    Field checks run first, the checks querying the database are @validates_schema and only run when
+    every field is valid.
+    """
+    validator = _validators.get(schema_class)
+    if validator is None:
+        with _validators_lock:
+            validator = _validators.get(schema_class)
+            if validator is None:
+                validator = _validators[schema_class] = schema_class()
+    return validator
+
+
 # Manage User
 class CreateUserValidation(Schema):
     """
@@ -24,15 +156,15 @@ class CreateUserValidation(Schema):
     creator_id = fields.String(required=False)
     group_id = fields.String(required=True)
 
-    @validates("email")
-    def validate_email(self, value):
-        if User.check_user_exists(value):
-            raise ValidationError("Email đã tồn tại")
+    @validates_schema
+    def validate_email(self, data, **kwargs):
+        if "email" in data and User.check_user_exists(data["email"]):
+            raise ValidationError("Email đã tồn tại", "email")
 
-    @validates("username")
-    def validate_username(self, value):
-        if User.check_user_exists(value):
-            raise ValidationError("Username đã tồn tại")
+    @validates_schema
+    def validate_username(self, data, **kwargs):
+        if "username" in data and User.check_user_exists(data["username"]):
+            raise ValidationError("Username đã tồn tại", "username")
 
     # Clean up data
     @pre_load
@@ -92,7 +224,7 @@ class GroupSchemaTMP(Schema):
     name = fields.String()
 
 
-class UserSchema(Schema):
+class UserSchema(CompiledSchema, PrefetchSchema):
     """
     Validator
     """
@@ -116,10 +248,14 @@ class GetUserValidation(Schema):
     """
     page = fields.Integer(required=False)
     page_size = fields.Integer(required=False)
+    total = fields.String(required=False, validate=validate.OneOf(["exact", "approx", "none"]))
+    cursor = CursorField(required=False)
     from_date = fields.Integer(required=False)
     to_date = fields.Integer(required=False)
     search_name = fields.String(required=False)
     group_id = fields.String(required=False)
+    fieldset = FieldsetField(required=False, data_key='fields')
+    include = FieldsetField(required=False)
 
     sort_by = fields.String(required=False,
                             validate=validate.OneOf(
@@ -137,10 +273,10 @@ class CreateRoleValidation(Schema):
     creator_id = fields.String(required=False)
     permission_ids = fields.List(fields.String(required=False))
 
-    @validates("name")
-    def validate_name(self, value):
-        if Role.check_role_exists(value):
-            raise ValidationError("Role đã tồn tại")
+    @validates_schema
+    def validate_name(self, data, **kwargs):
+        if "name" in data and Role.check_role_exists(data["name"]):
+            raise ValidationError("Role đã tồn tại", "name")
 
     # Clean up data
     @pre_load
@@ -183,7 +319,7 @@ class PermissionSchema(Schema):
     module = fields.String()
 
 
-class RoleSchema(Schema):
+class RoleSchema(PrefetchSchema):
     """
     Validator
     """
@@ -192,7 +328,7 @@ class RoleSchema(Schema):
     module = fields.String()
     description = fields.String()
     creator_id = fields.String(required=False)
-    creator = fields.Nested(UserSchema(only=['id', 'email', "first_name", "last_name", "avatar_url"]))
+    creator = UserSummaryField('creator_id')
     permissions = fields.List(fields.Nested(PermissionSchema()))
 
 
@@ -201,6 +337,8 @@ class GetRoleValidation(Schema):
     """
     page = fields.Integer(required=False)
     page_size = fields.Integer(required=False)
+    total = fields.String(required=False, validate=validate.OneOf(["exact", "approx", "none"]))
+    cursor = CursorField(required=False)
     from_date = fields.Integer(required=False)
     to_date = fields.Integer(required=False)
     search_name = fields.String(required=False)
@@ -220,10 +358,10 @@ class CreateGroupValidation(Schema):
     description = fields.String(required=False)
     role_ids = fields.List(fields.String(required=False))
 
-    @validates("name")
-    def validate_name(self, value):
-        if Group.check_group_exists(value):
-            raise ValidationError("Group đã tồn tại")
+    @validates_schema
+    def validate_name(self, data, **kwargs):
+        if "name" in data and Group.check_group_exists(data["name"]):
+            raise ValidationError("Group đã tồn tại", "name")
 
     # Clean up data
     @pre_load
@@ -240,10 +378,10 @@ class CreateTopicValidation(Schema):
     name = fields.String(required=True)
     description = fields.String(required=False)
 
-    @validates("name")
-    def validate_name(self, value):
-        if TopicQuestion.check_topic_exists(value):
-            raise ValidationError("Topic đã tồn tại")
+    @validates_schema
+    def validate_name(self, data, **kwargs):
+        if "name" in data and TopicQuestion.check_topic_exists(data["name"]):
+            raise ValidationError("Topic đã tồn tại", "name")
 
     # Clean up data
     @pre_load
@@ -277,10 +415,10 @@ class CreateQuestionValidation(Schema):
     assignee_user_id = fields.String(required=True)
     status = fields.String(required=False)
 
-    @validates("title")
-    def validate_name(self, value):
-        if Question.check_question_exists(value):
-            raise ValidationError("Question đã tồn tại")
+    @validates_schema
+    def validate_name(self, data, **kwargs):
+        if "title" in data and Question.check_question_exists(data["title"]):
+            raise ValidationError("Question đã tồn tại", "title")
 
     # Clean up data
     @pre_load
@@ -298,10 +436,10 @@ class CreateFormValidation(Schema):
     description = fields.String(required=False)
     link = fields.String(required=True)
 
-    @validates("name")
-    def validate_name(self, value):
-        if Form.check_form_exists(value):
-            raise ValidationError("Form đã tồn tại")
+    @validates_schema
+    def validate_name(self, data, **kwargs):
+        if "name" in data and Form.check_form_exists(data["name"]):
+            raise ValidationError("Form đã tồn tại", "name")
 
     # Clean up data
     @pre_load
@@ -318,10 +456,10 @@ class CreateFrequentQuestionValidation(Schema):
     question = fields.String(required=True)
     answer = fields.String(required=True)
 
-    @validates("question")
-    def validate_question(self, question):
-        if FrequentQuestion.check_frequent_question_exists(question):
-            raise ValidationError("Frequent question đã tồn tại")
+    @validates_schema
+    def validate_question(self, data, **kwargs):
+        if "question" in data and FrequentQuestion.check_frequent_question_exists(data["question"]):
+            raise ValidationError("Frequent question đã tồn tại", "question")
 
     # Clean up data
     @pre_load
@@ -339,15 +477,15 @@ class CreateSubjectValidation(Schema):
     code = fields.String(required=False)
     number_of_credit = fields.Integer(required=False)
 
-    @validates("name")
-    def validate_name(self, value):
-        if Subject.check_subject_name_exists(value):
-            raise ValidationError("Name đã tồn tại")
+    @validates_schema
+    def validate_name(self, data, **kwargs):
+        if "name" in data and Subject.check_subject_name_exists(data["name"]):
+            raise ValidationError("Name đã tồn tại", "name")
 
-    @validates("code")
-    def validate_code(self, value):
-        if Subject.check_subject_code_exists(value):
-            raise ValidationError("Code đã tồn tại")
+    @validates_schema
+    def validate_code(self, data, **kwargs):
+        if "code" in data and Subject.check_subject_code_exists(data["code"]):
+            raise ValidationError("Code đã tồn tại", "code")
 
     # Clean up data
     @pre_load
@@ -497,7 +635,7 @@ class UpdateSubjectValidation(Schema):
             raise ValidationError('Code đã tồn tại')
 
 
-class GroupSchema(Schema):
+class GroupSchema(PrefetchSchema):
     """
     Validator
     """
@@ -505,11 +643,11 @@ class GroupSchema(Schema):
     name = fields.String()
     description = fields.String()
     creator_id = fields.String(required=False)
-    creator = fields.Nested(UserSchema(only=['id', 'email', "first_name", "last_name", "avatar_url"]))
+    creator = UserSummaryField('creator_id')
     roles = fields.List(fields.Nested(RoleSchema(only=['id', 'name'])))
 
 
-class FrequentQuestionSchema(Schema):
+class FrequentQuestionSchema(PrefetchSchema):
     """
     Validator
     """
@@ -517,10 +655,10 @@ class FrequentQuestionSchema(Schema):
     question = fields.String()
     answer = fields.String()
     creator_id = fields.String(required=False)
-    creator = fields.Nested(UserSchema(only=['id', 'email', "first_name", "last_name", "avatar_url"]))
+    creator = UserSummaryField('creator_id')
 
 
-class SubjectSchema(Schema):
+class SubjectSchema(PrefetchSchema):
     """
     Validator
     """
@@ -529,10 +667,10 @@ class SubjectSchema(Schema):
     code = fields.String()
     number_of_credit = fields.Integer()
     creator_id = fields.String(required=False)
-    creator = fields.Nested(UserSchema(only=['id', 'email', "first_name", "last_name", "avatar_url"]))
+    creator = UserSummaryField('creator_id')
 
 
-class TopicSchema(Schema):
+class TopicSchema(PrefetchSchema):
     """
     Validator
     """
@@ -540,7 +678,7 @@ class TopicSchema(Schema):
     name = fields.String()
     description = fields.String()
     creator_id = fields.String(required=False)
-    creator = fields.Nested(UserSchema(only=['id', 'email', "first_name", "last_name", "avatar_url"]))
+    creator = UserSummaryField('creator_id')
     number_of_questions = fields.Integer()
 
 
@@ -552,7 +690,7 @@ class StatisticTopicSchema(Schema):
     number_of_questions = fields.Integer()
 
 
-class QuestionSchema(Schema):
+class QuestionSchema(CompiledSchema, PrefetchSchema):
     """
     Validator
     """
@@ -567,13 +705,13 @@ class QuestionSchema(Schema):
     user_id = fields.String()
     assignee_user_id = fields.String()
     creator_id = fields.String(required=False)
-    creator = fields.Nested(UserSchema(only=['id', 'email', "first_name", "last_name", "avatar_url"]))
-    assignee_user = fields.Nested(UserSchema(only=['id', 'email', "first_name", "last_name", "avatar_url"]))
-    user = fields.Nested(UserSchema(only=['id', 'email', "first_name", "last_name", "avatar_url"]))
+    creator = UserSummaryField('creator_id')
+    assignee_user = UserSummaryField('assignee_user_id')
+    user = UserSummaryField('user_id')
     topic = fields.Nested(TopicSchema())
 
 
-class CommentSchema(Schema):
+class CommentSchema(CompiledSchema, PrefetchSchema):
     """
     Validator
     """
@@ -587,7 +725,7 @@ class CommentSchema(Schema):
     sender = fields.Nested(UserSchema())
 
 
-class HistorySchema(Schema):
+class HistorySchema(CompiledSchema, PrefetchSchema):
     """
     Validator
     """
@@ -598,11 +736,11 @@ class HistorySchema(Schema):
     creator_id = fields.String()
     assignee_user_id = fields.String()
     question_id = fields.String()
-    creator = fields.Nested(UserSchema(only=['id', 'email', "first_name", "last_name", "avatar_url"]))
-    assignee_user = fields.Nested(UserSchema(only=['id', 'email', "first_name", "last_name", "avatar_url"]))
+    creator = UserSummaryField('creator_id')
+    assignee_user = UserSummaryField('assignee_user_id')
 
 
-class FormSchema(Schema):
+class FormSchema(PrefetchSchema):
     """
     Validator
     """
@@ -611,7 +749,7 @@ class FormSchema(Schema):
     description = fields.String()
     link = fields.String()
     creator_id = fields.String(required=False)
-    creator = fields.Nested(UserSchema(only=['id', 'email', "first_name", "last_name", "avatar_url"]))
+    creator = UserSummaryField('creator_id')
 
 
 class GetTopicValidation(Schema):
@@ -619,6 +757,8 @@ class GetTopicValidation(Schema):
     """
     page = fields.Integer(required=False)
     page_size = fields.Integer(required=False)
+    total = fields.String(required=False, validate=validate.OneOf(["exact", "approx", "none"]))
+    cursor = CursorField(required=False)
     from_date = fields.Integer(required=False)
     to_date = fields.Integer(required=False)
     search_name = fields.String(required=False)
@@ -634,10 +774,14 @@ class GetQuestionValidation(Schema):
     """
     page = fields.Integer(required=False)
     page_size = fields.Integer(required=False)
+    total = fields.String(required=False, validate=validate.OneOf(["exact", "approx", "none"]))
+    cursor = CursorField(required=False)
     from_date = fields.Integer(required=False)
     to_date = fields.Integer(required=False)
     search_name = fields.String(required=False)
     status = fields.String(required=False)
+    fieldset = FieldsetField(required=False, data_key='fields')
+    include = FieldsetField(required=False)
 
     sort_by = fields.String(required=False,
                             validate=validate.OneOf(
@@ -650,6 +794,20 @@ class GetQuestionDetailValidation(Schema):
     """
     page = fields.Integer(required=False)
     page_size = fields.Integer(required=False)
+    total = fields.String(required=False, validate=validate.OneOf(["exact", "approx", "none"]))
+    fieldset = FieldsetField(required=False, data_key='fields')
+    include = FieldsetField(required=False)
+
+
+class GetFieldsetValidation(Schema):
+    """
+    Params of the detail endpoints, which ignored their params before
+    """
+    fieldset = FieldsetField(required=False, data_key='fields')
+    include = FieldsetField(required=False)
+
+    class Meta:
+        unknown = EXCLUDE
 
 
 class GetFormValidation(Schema):
@@ -657,6 +815,8 @@ class GetFormValidation(Schema):
     """
     page = fields.Integer(required=False)
     page_size = fields.Integer(required=False)
+    total = fields.String(required=False, validate=validate.OneOf(["exact", "approx", "none"]))
+    cursor = CursorField(required=False)
     search_name = fields.String(required=False)
 
     sort_by = fields.String(required=False,
@@ -670,6 +830,8 @@ class GetFrequentQuestionValidation(Schema):
     """
     page = fields.Integer(required=False)
     page_size = fields.Integer(required=False)
+    total = fields.String(required=False, validate=validate.OneOf(["exact", "approx", "none"]))
+    cursor = CursorField(required=False)
     from_date = fields.Integer(required=False)
     to_date = fields.Integer(required=False)
     search_name = fields.String(required=False)
@@ -690,6 +852,8 @@ class GetSubjectValidation(Schema):
     """
     page = fields.Integer(required=False)
     page_size = fields.Integer(required=False)
+    total = fields.String(required=False, validate=validate.OneOf(["exact", "approx", "none"]))
+    cursor = CursorField(required=False)
     from_date = fields.Integer(required=False)
     to_date = fields.Integer(required=False)
     search_name = fields.String(required=False)
@@ -705,6 +869,8 @@ class GetGroupValidation(Schema):
     """
     page = fields.Integer(required=False)
     page_size = fields.Integer(required=False)
+    total = fields.String(required=False, validate=validate.OneOf(["exact", "approx", "none"]))
+    cursor = CursorField(required=False)
     from_date = fields.Integer(required=False)
     to_date = fields.Integer(required=False)
     search_name = fields.String(required=False)
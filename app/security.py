@@ -0,0 +1,144 @@
+import hmac
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordPoolBusy(Exception):
+    """
+    Raised when the password pool queue is full
+    """
+    pass
+
+
+class PasswordHasher(object):
+    """
+    Bounded pool of threads hashing and checking passwords out of the request threads.
+    hashlib releases the GIL while computing pbkdf2, so the workers run in parallel.
+
+    Config:
+        PASSWORD_HASH_METHOD: werkzeug hash method with its cost, ex "pbkdf2:sha256:150000"
+        PASSWORD_SALT_LENGTH: salt length of new hashes
+        PASSWORD_POOL_WORKERS: number of hashing threads
+        PASSWORD_POOL_QUEUE_SIZE: max jobs waiting for a worker, more jobs raise PasswordPoolBusy
+        PASSWORD_POOL_TIMEOUT: max seconds a request waits for its job
+    """
+
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256:150000'
+        self.salt_length = 8
+        self.workers = 4
+        self.queue_size = 64
+        self.timeout = 10
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._stats = dict(submitted=0, rejected=0, completed=0, in_flight=0, busy=0,
+                           wait_total=0.0, wait_max=0.0, run_total=0.0)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.salt_length = app.config.get('PASSWORD_SALT_LENGTH', self.salt_length)
+        self.workers = app.config.get('PASSWORD_POOL_WORKERS', self.workers)
+        self.queue_size = app.config.get('PASSWORD_POOL_QUEUE_SIZE', self.queue_size)
+        self.timeout = app.config.get('PASSWORD_POOL_TIMEOUT', self.timeout)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password')
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+
+    def _run(self, fn, *args):
+        if self._executor is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise PasswordPoolBusy('Password pool is busy')
+        submitted_at = time.monotonic()
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['in_flight'] += 1
+
+        def job():
+            started_at = time.monotonic()
+            wait = started_at - submitted_at
+            with self._lock:
+                self._stats['busy'] += 1
+                self._stats['wait_total'] += wait
+                self._stats['wait_max'] = max(self._stats['wait_max'], wait)
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._stats['busy'] -= 1
+                    self._stats['in_flight'] -= 1
+                    self._stats['completed'] += 1
+                    self._stats['run_total'] += time.monotonic() - started_at
+                self._slots.release()
+
+        future = self._executor.submit(job)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                # the job never started, give its slot back
+                with self._lock:
+                    self._stats['in_flight'] -= 1
+                    self._stats['rejected'] += 1
+                self._slots.release()
+            raise PasswordPoolBusy('Password pool timed out')
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        """
+        True when the hash was not made with the configured method, cost and salt length
+        """
+        if not pwhash or pwhash.count('$') < 2:
+            return True
+        method, salt, _ = pwhash.split('$', 2)
+        return method != self.method or len(salt) != self.salt_length
+
+    def check_user_password(self, user, password: str):
+        """
+        Check the password of a user. The plain password column stays the reference while it is filled:
+        update_user used to change it without password_hash, so the hash of a user may still hold the
+        password before a reset. A login with the current password replaces such a hash.
+        Returns:
+            (valid, new_hash): new_hash is set when the stored hash must be replaced
+        """
+        if user.password is not None:
+            if not hmac.compare_digest(user.password.encode('utf-8'), password.encode('utf-8')):
+                return False, None
+            if self.needs_rehash(user.password_hash) or not self.verify(user.password_hash, password):
+                return True, self.hash(password)
+            return True, None
+        if not user.password_hash or not self.verify(user.password_hash, password):
+            return False, None
+        if self.needs_rehash(user.password_hash):
+            return True, self.hash(password)
+        return True, None
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        completed = stats['completed'] or 1
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "busy": stats['busy'],
+            "queued": stats['in_flight'] - stats['busy'],
+            "utilisation": stats['busy'] / self.workers if self.workers else 0,
+            "submitted": stats['submitted'],
+            "completed": stats['completed'],
+            "rejected": stats['rejected'],
+            "wait_avg_ms": round(stats['wait_total'] / completed * 1000, 3),
+            "wait_max_ms": round(stats['wait_max'] * 1000, 3),
+            "run_avg_ms": round(stats['run_total'] / completed * 1000, 3)
+        }
@@ -0,0 +1,162 @@
+import threading
+
+from marshmallow import fields, missing
+
+from app.loader import prefetch, get_nested_schema, UserSummaryField, user_summaries
+
+
+def _can_compile(schema) -> bool:
+    """
+    The compiled function does not run hooks, a schema with @pre_dump/@post_dump... needs Schema.dump
+    """
+    return not any(schema._hooks.values())
+
+
+def _get_shape(schema) -> frozenset:
+    """
+    Fields a schema dumps on every level, once marshmallow applied only=/exclude=, ex: topic.name
+    """
+    shape = []
+    for field_name, field in schema.dump_fields.items():
+        nested = get_nested_schema(field)
+        shape.append((field_name, None if nested is None else _get_shape(nested)))
+    return frozenset(shape)
+
+
+class SerializerCompiler(object):
+    """
+    Turns a marshmallow schema, with its only=/exclude= and nested schemas, into one Python function
+    reading the attributes of a model instance and building the dict Schema.dump would return.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.namespace = {'missing': missing, 'user_summaries': user_summaries}
+        self.functions = {}
+
+    def emit(self, line: str, indent: int = 1):
+        self.lines.append('    ' * indent + line)
+
+    def compile(self, schema) -> str:
+        """
+        Returns:
+            name of the generated function dumping one object
+        """
+        key = id(schema)
+        if key in self.functions:
+            return self.functions[key]
+        name = '_dump_{}_{}'.format(type(schema).__name__, len(self.functions))
+        self.functions[key] = name
+        if not _can_compile(schema):
+            self.namespace[name + '_schema'] = schema
+            self.lines.append('def {}(obj):'.format(name))
+            self.emit('return {}_schema.dump(obj, many=False)'.format(name))
+            self.lines.append('')
+            return name
+        body = []
+        for index, (field_name, field) in enumerate(schema.dump_fields.items()):
+            body.extend(self.compile_field(name, index, field_name, field))
+        self.lines.append('def {}(obj):'.format(name))
+        self.emit('result = {}')
+        self.lines.extend(body)
+        self.emit('return result')
+        self.lines.append('')
+        return name
+
+    def compile_field(self, function: str, index: int, field_name: str, field) -> list:
+        key = repr(field.data_key if field.data_key is not None else field_name)
+        attribute = field.attribute or field_name
+        simple = field.dump_default is missing and '.' not in attribute
+        attribute = repr(attribute)
+        lines = []
+
+        def emit(line, indent=1):
+            lines.append('    ' * indent + line)
+
+        if isinstance(field, UserSummaryField):
+            emit('value = getattr(obj, {!r}, missing)'.format(field.key))
+            emit('if value is not missing:')
+            emit('summary = user_summaries.get(value)', 2)
+            emit('result[{}] = None if summary is None else summary.to_dict()'.format(key), 2)
+        elif simple and type(field) in (fields.String, fields.Integer) and not getattr(field, 'as_string', False):
+            convert = 'str' if isinstance(field, fields.String) else 'int'
+            emit('value = getattr(obj, {}, missing)'.format(attribute))
+            emit('if value is not missing:')
+            emit('result[{}] = None if value is None else {}(value)'.format(key, convert), 2)
+        elif simple and type(field) is fields.Nested:
+            nested = self.compile(field.schema)
+            emit('value = getattr(obj, {}, missing)'.format(attribute))
+            emit('if value is not missing:')
+            if field.schema.many or field.many:
+                emit('result[{}] = None if value is None else [{}(item) for item in value]'.format(key, nested), 2)
+            else:
+                emit('result[{}] = None if value is None else {}(value)'.format(key, nested), 2)
+        elif simple and type(field) is fields.List and type(field.inner) is fields.Nested:
+            nested = self.compile(field.inner.schema)
+            emit('value = getattr(obj, {}, missing)'.format(attribute))
+            emit('if value is not missing:')
+            emit('result[{}] = None if value is None else [{}(item) for item in value]'.format(key, nested), 2)
+        else:
+            # any other field goes through marshmallow
+            field_var = '{}_field_{}'.format(function, index)
+            self.namespace[field_var] = field
+            emit('value = {}.serialize({!r}, obj)'.format(field_var, field_name))
+            emit('if value is not missing:')
+            emit('result[{}] = value'.format(key), 2)
+        return lines
+
+    def build(self, schema):
+        name = self.compile(schema)
+        source = '\n'.join(self.lines)
+        exec(compile(source, '<serializer {}>'.format(type(schema).__name__), 'exec'), self.namespace)
+        return self.namespace[name], source
+
+
+class CompiledSerializer(object):
+    """
+    Fast equivalent of Schema.dump for model instances, built once per schema shape
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.function, self.source = SerializerCompiler().build(schema)
+
+    def dump(self, obj, many: bool = False):
+        objects = list(obj) if many else [obj]
+        loaded = prefetch(self.schema, objects)
+        data = [self.function(item) for item in objects] if many else self.function(obj)
+        # the prefetched rows stay referenced until the dump is over
+        del loaded
+        return data
+
+
+class CompiledSchema(object):
+    """
+    Schema mixin whose dump() runs a CompiledSerializer, compiled on first use for each set of dumped fields.
+    only= comes from the fields request param, past MAX_SERIALIZERS shapes the others use Schema.dump.
+    """
+    MAX_SERIALIZERS = 256
+    _serializers = {}
+    _serializers_lock = threading.Lock()
+
+    def _init_fields(self):
+        super()._init_fields()
+        # Nested narrows a copy of a nested schema instance after __init__, read the fields again
+        self._shape = None
+
+    def dump(self, obj, *, many: bool = None):
+        many = self.many if many is None else bool(many)
+        if self.context or not _can_compile(self):
+            return super().dump(obj, many=many)
+        if self._shape is None:
+            self._shape = _get_shape(self)
+        key = (type(self), self._shape)
+        serializer = CompiledSchema._serializers.get(key)
+        if serializer is None:
+            with CompiledSchema._serializers_lock:
+                serializer = CompiledSchema._serializers.get(key)
+                if serializer is None and len(CompiledSchema._serializers) < self.MAX_SERIALIZERS:
+                    serializer = CompiledSchema._serializers[key] = CompiledSerializer(self)
+        if serializer is None:
+            return super().dump(obj, many=many)
+        return serializer.dump(obj, many=many)
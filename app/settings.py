@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 os_env = os.environ
 
@@ -7,6 +8,47 @@ class Config(object):
     SECRET_KEY = '3nF3Rn0'
     APP_DIR = os.path.abspath(os.path.dirname(__file__))  # This directory
     PROJECT_ROOT = os.path.abspath(os.path.join(APP_DIR, os.pardir))
+    # Seconds a group's permission list stays cached in a worker
+    PERMISSION_CACHE_TTL = 300
+    # Token revocation cache: "memory" is per worker, "file" is shared by all workers of the host
+    REVOCATION_CACHE_BACKEND = 'memory'
+    REVOCATION_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'flask_api_docs_revocation.sqlite3')
+    REVOCATION_CACHE_TTL = 60
+    REVOCATION_CACHE_SIZE = 100000
+    # "row": revoke-all flags every token row, "epoch": revoke-all bumps User.token_epoch (revoke_all_token2,
+    # which keeps the current token, flags the rows in both modes)
+    TOKEN_REVOCATION_MODE = 'row'
+    # Expired token cleanup, 0 disables the background pruner
+    TOKEN_PRUNE_INTERVAL = 3600
+    TOKEN_PRUNE_BATCH_SIZE = 1000
+    # Recompute TopicQuestion.question_count, 0 disables the background repair
+    QUESTION_COUNT_REPAIR_INTERVAL = 86400
+    # Skip the signature check of access tokens already verified by this worker
+    JWT_VERIFIED_CACHE_ENABLED = False
+    JWT_VERIFIED_CACHE_TTL = 60
+    JWT_VERIFIED_CACHE_SIZE = 10000
+    # Password hashing runs in a bounded pool, hashes made with another method are upgraded on login
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:150000'
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_POOL_WORKERS = 4
+    PASSWORD_POOL_QUEUE_SIZE = 64
+    PASSWORD_POOL_TIMEOUT = 10
+    # Seconds between two reloads of the message table, 0 only loads it at startup
+    MESSAGE_CATALOG_TTL = 300
+    # Seconds a list total stays cached in a worker, 0 counts on every request
+    COUNT_CACHE_TTL = 30
+    COUNT_CACHE_SIZE = 4096
+    # Users nested in responses (id, email, names, avatar), invalidated by update_user and delete_user of this worker
+    USER_SUMMARY_CACHE_SIZE = 10000
+    USER_SUMMARY_CACHE_TTL = 300
+    # Frequently asked questions suggested for a new question (cosine similarity of character trigrams)
+    FAQ_MATCH_THRESHOLD = 0.8
+    FAQ_MATCH_LIMIT = 3
+    FAQ_MATCH_TTL = 300
+    # Near-duplicate questions (MinHash of character trigrams), the index is rebuilt every DUPLICATE_INDEX_TTL seconds
+    DUPLICATE_QUESTION_THRESHOLD = 0.6
+    DUPLICATE_QUESTION_LIMIT = 3
+    DUPLICATE_INDEX_TTL = 600
 
 
 class ProdConfig(Config):
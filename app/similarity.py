@@ -0,0 +1,327 @@
+import math
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from app.enums import THRESHOLD
+from app.models import FrequentQuestion, Question
+from app.utils import fold_text, get_trigrams
+
+
+def get_features(text: str) -> dict:
+    """
+    Character trigrams of the words of a text, accents and case removed
+    Returns:
+        trigram -> number of occurrences
+    """
+    features = {}
+    for word in fold_text(text or '').split():
+        for trigram in get_trigrams(word):
+            features[trigram] = features.get(trigram, 0) + 1
+    return features
+
+
+class FaqIndex(object):
+    """
+    TF-IDF matrix of character trigrams of frequently asked questions, one L2 normalised row per question.
+    Immutable, FaqMatcher swaps it for a new one when the questions change.
+    """
+
+    def __init__(self, ids, texts):
+        self.ids = tuple(ids)
+        documents = [get_features(text) for text in texts]
+        vocabulary = {}
+        for features in documents:
+            for trigram in features:
+                vocabulary.setdefault(trigram, len(vocabulary))
+        self.vocabulary = vocabulary
+        matrix = np.zeros((len(documents), len(vocabulary)), dtype=np.float32)
+        for row, features in enumerate(documents):
+            for trigram, count in features.items():
+                matrix[row, vocabulary[trigram]] = 1 + math.log(count)
+        document_frequency = np.count_nonzero(matrix, axis=0)
+        self.idf = (np.log((1 + len(documents)) / (1 + document_frequency)) + 1).astype(np.float32)
+        matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        self.matrix = matrix / norms
+
+    def __len__(self):
+        return len(self.ids)
+
+    def vectorize(self, text: str):
+        """
+        Returns:
+            L2 normalised TF-IDF vector of a text over the vocabulary, None when no trigram is known
+        """
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for trigram, count in get_features(text).items():
+            column = self.vocabulary.get(trigram)
+            if column is not None:
+                vector[column] = 1 + math.log(count)
+        vector *= self.idf
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None
+        return vector / norm
+
+    def search(self, text: str, threshold: float, limit: int) -> list:
+        """
+        Cosine similarity of a text with every question, in one matrix product
+        Returns:
+            [(frequent_question_id, score)], best first
+        """
+        if not self.ids:
+            return []
+        vector = self.vectorize(text)
+        if vector is None:
+            return []
+        scores = self.matrix @ vector
+        rows = np.flatnonzero(scores >= threshold)
+        if len(rows) > limit:
+            rows = rows[np.argpartition(-scores[rows], limit - 1)[:limit]]
+        rows = rows[np.argsort(-scores[rows], kind='stable')]
+        return [(self.ids[row], round(float(scores[row]), 4)) for row in rows]
+
+
+class FaqMatcher(object):
+    """
+    Finds the frequently asked questions similar to an incoming question. The index is built on first use
+    and rebuilt after invalidate() or FAQ_MATCH_TTL seconds, for changes made by other workers.
+
+    Config:
+        FAQ_MATCH_THRESHOLD: min cosine similarity of a match
+        FAQ_MATCH_LIMIT: max matches returned
+        FAQ_MATCH_TTL: max seconds the index is trusted, 0 only rebuilds it after invalidate()
+    """
+
+    def __init__(self, app=None):
+        self.threshold = THRESHOLD
+        self.limit = 3
+        self.ttl = 300
+        self._index = None
+        self._built_at = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.threshold = app.config.get('FAQ_MATCH_THRESHOLD', THRESHOLD)
+        self.limit = app.config.get('FAQ_MATCH_LIMIT', 3)
+        self.ttl = app.config.get('FAQ_MATCH_TTL', 300)
+
+    def invalidate(self):
+        self._generation += 1
+        self._index = None
+
+    def get_index(self) -> FaqIndex:
+        index = self._index
+        if index is not None and (not self.ttl or time.monotonic() - self._built_at < self.ttl):
+            return index
+        with self._lock:
+            # another thread may have rebuilt it while this one was waiting
+            if self._index is not index and self._index is not None:
+                return self._index
+            generation = self._generation
+            rows = FrequentQuestion.query.with_entities(FrequentQuestion.id, FrequentQuestion.question) \
+                .order_by(FrequentQuestion.id).all()
+            index = FaqIndex([row.id for row in rows], [row.question for row in rows])
+            self._built_at = time.monotonic()
+            # questions changed while this index was built, the next call builds it again
+            self._index = index if generation == self._generation else None
+        return index
+
+    def match(self, text: str, threshold: float = None, limit: int = None) -> list:
+        """
+        Args:
+            text: title and description of a question
+            threshold: min score, FAQ_MATCH_THRESHOLD by default
+            limit: max matches, FAQ_MATCH_LIMIT by default
+        Returns:
+            [(frequent_question_id, score)], best first
+        """
+        threshold = self.threshold if threshold is None else threshold
+        limit = self.limit if limit is None else limit
+        if limit <= 0 or not (text or '').strip():
+            return []
+        return self.get_index().search(text, threshold, limit)
+
+    def match_question(self, question) -> list:
+        """
+        Frequently asked questions answering a question, with their score
+        Returns:
+            [(FrequentQuestion, score)], best first
+        """
+        matches = self.match(' '.join(filter(None, [question.title, question.description])))
+        if not matches:
+            return []
+        frequent_questions = {frequent_question.id: frequent_question for frequent_question in
+                              FrequentQuestion.query.filter(FrequentQuestion.id.in_([_id for _id, _ in matches]))}
+        return [(frequent_questions[_id], score) for _id, score in matches if _id in frequent_questions]
+
+
+faq_matcher = FaqMatcher()
+
+
+class MinHashIndex(object):
+    """
+    MinHash signatures of the character trigrams of questions, bucketed by LSH bands. A lookup only compares
+    the questions sharing a band with the text instead of the whole table. Two texts whose trigram sets have a
+    Jaccard similarity s share at least one band with probability 1 - (1 - s^rows)^bands.
+    Built from the database at startup and updated by the handlers writing questions.
+
+    Config:
+        DUPLICATE_QUESTION_THRESHOLD: min estimated Jaccard similarity of a near-duplicate
+        DUPLICATE_QUESTION_LIMIT: max near-duplicates returned
+        DUPLICATE_INDEX_TTL: seconds between two rebuilds from the database, for questions written by other
+            workers, 0 only builds it at startup
+    """
+    # Mersenne prime, (a * x + b) stays below 2 ** 64 for 32 bits hashes
+    PRIME = (1 << 31) - 1
+
+    def __init__(self, bands: int = 16, rows: int = 4, seed: int = 1, app=None):
+        self.bands = bands
+        self.rows = rows
+        self.threshold = 0.6
+        self.limit = 3
+        self.ttl = 300
+        random = np.random.RandomState(seed)
+        # same seed in every worker, so signatures are comparable
+        self._a = random.randint(1, self.PRIME, size=bands * rows).astype(np.uint64)
+        self._b = random.randint(0, self.PRIME, size=bands * rows).astype(np.uint64)
+        self._signatures = {}
+        self._buckets = [{} for _ in range(bands)]
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.threshold = app.config.get('DUPLICATE_QUESTION_THRESHOLD', self.threshold)
+        self.limit = app.config.get('DUPLICATE_QUESTION_LIMIT', self.limit)
+        self.ttl = app.config.get('DUPLICATE_INDEX_TTL', self.ttl)
+
+    @staticmethod
+    def get_text(question) -> str:
+        return ' '.join(filter(None, [question.title, question.description]))
+
+    def signature(self, text: str):
+        """
+        Returns:
+            MinHash signature of the trigrams of a text, None when the text has no word
+        """
+        shingles = get_features(text)
+        if not shingles:
+            return None
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64,
+                             count=len(shingles))
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % self.PRIME).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature) -> list:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def _add(self, _id: str, signature):
+        self._signatures[_id] = signature
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(key, set()).add(_id)
+
+    def _remove(self, _id: str):
+        signature = self._signatures.pop(_id, None)
+        if signature is None:
+            return
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            ids = bucket.get(key)
+            if ids is not None:
+                ids.discard(_id)
+                if not ids:
+                    del bucket[key]
+
+    def add(self, question):
+        """
+        Index a question, replacing its previous title and description
+        """
+        signature = self.signature(self.get_text(question))
+        with self._lock:
+            self._remove(question.id)
+            if signature is not None:
+                self._add(question.id, signature)
+
+    def remove(self, question_id: str):
+        with self._lock:
+            self._remove(question_id)
+
+    def rebuild(self, batch_size: int = 1000) -> int:
+        """
+        Index every question of the database
+        Returns:
+            number of questions
+        """
+        signatures = {}
+        last_id = ''
+        while True:
+            rows = Question.query.with_entities(Question.id, Question.title, Question.description) \
+                .filter(Question.id > last_id).order_by(Question.id).limit(batch_size).all()
+            if not rows:
+                break
+            for row in rows:
+                signature = self.signature(self.get_text(row))
+                if signature is not None:
+                    signatures[row.id] = signature
+            last_id = rows[-1].id
+        buckets = [{} for _ in range(self.bands)]
+        for _id, signature in signatures.items():
+            for bucket, key in zip(buckets, self._band_keys(signature)):
+                bucket.setdefault(key, set()).add(_id)
+        with self._lock:
+            self._signatures = signatures
+            self._buckets = buckets
+        return len(signatures)
+
+    def search(self, text: str, threshold: float = None, limit: int = None, exclude: str = None) -> list:
+        """
+        Args:
+            text: title and description of a question
+            threshold: min estimated similarity, DUPLICATE_QUESTION_THRESHOLD by default
+            limit: max results, DUPLICATE_QUESTION_LIMIT by default
+            exclude: id of the question itself
+        Returns:
+            [(question_id, score)], best first
+        """
+        threshold = self.threshold if threshold is None else threshold
+        limit = self.limit if limit is None else limit
+        signature = self.signature(text)
+        if signature is None or limit <= 0:
+            return []
+        with self._lock:
+            candidates = set()
+            for bucket, key in zip(self._buckets, self._band_keys(signature)):
+                candidates |= bucket.get(key, set())
+            candidates.discard(exclude)
+            candidates = [(_id, self._signatures[_id]) for _id in candidates]
+        matches = []
+        for _id, candidate in candidates:
+            score = float(np.count_nonzero(candidate == signature)) / len(signature)
+            if score >= threshold:
+                matches.append((_id, round(score, 4)))
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches[:limit]
+
+    def find_duplicates(self, question) -> list:
+        """
+        Questions which are near-duplicates of a question, with their score
+        Returns:
+            [(Question, score)], best first
+        """
+        matches = self.search(self.get_text(question), exclude=question.id)
+        if not matches:
+            return []
+        questions = {item.id: item for item in Question.query.filter(Question.id.in_([_id for _id, _ in matches]))}
+        return [(questions[_id], score) for _id, score in matches if _id in questions]
+
+    def __len__(self):
+        return len(self._signatures)
+
+
+question_duplicate_index = MinHashIndex()
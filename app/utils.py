@@ -1,7 +1,13 @@
+import base64
+import json
+import math
 import re
 import datetime
+import unicodedata
 from pytz import timezone
 
+from app.extensions import count_cache
+
 # Regex validate
 RE_ONLY_NUMBERS = r'^(\d+)$'
 RE_ONLY_CHARACTERS = r'^[a-zA-Z]+$'
@@ -84,3 +90,103 @@ def escape_wildcard(search):
     search5 = str.replace(search4, r'"', r'\"')
     search6 = str.replace(search5, r"'", r"\'")
     return search6
+
+
+def fold_text(value: str) -> str:
+    """
+    Lower case text without Vietnamese diacritics, ex: "Nguyễn Đức" -> "nguyen duc"
+    """
+    value = unicodedata.normalize('NFKD', value.replace('đ', 'd').replace('Đ', 'D'))
+    return ''.join(char for char in value if not unicodedata.combining(char)).lower()
+
+
+def get_trigrams(token: str) -> set:
+    """
+    Trigrams of a folded token padded with spaces, " ab" marks the prefix "ab"
+    """
+    padded = ' {} '.format(token)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class OffsetPage(object):
+    """
+    A page of page/page_size pagination, same attributes as sqlalchemy_pagination.Page.
+    total and pages are None when the total was not asked for.
+    """
+
+    def __init__(self, items: list, page: int, page_size: int, total: int = None, has_next: bool = None,
+                 estimated: bool = False):
+        self.items = items
+        self.has_previous = page > 1
+        self.previous_page = page - 1 if self.has_previous else None
+        if total is not None:
+            if estimated and items:
+                # an estimate can be lower than the rows already seen
+                total = max(total, (page - 1) * page_size + len(items))
+            has_next = (page - 1) * page_size + len(items) < total
+        self.has_next = bool(has_next)
+        self.next_page = page + 1 if self.has_next else None
+        self.total = total
+        self.pages = int(math.ceil(total / float(page_size))) if total is not None else None
+
+
+def paginate(query, page: int, page_size: int, total: str = 'exact') -> OffsetPage:
+    """
+    OFFSET/LIMIT pagination
+    Args:
+        query:
+        page: from 1
+        page_size:
+        total: "exact" (cached COUNT), "approx" (optimizer estimate) or "none" (no count)
+    Returns:
+        OffsetPage
+    """
+    if page <= 0:
+        raise AttributeError('page needs to be >= 1')
+    if page_size <= 0:
+        raise AttributeError('page_size needs to be >= 1')
+    if total == 'none':
+        items = query.limit(page_size + 1).offset((page - 1) * page_size).all()
+        return OffsetPage(items[:page_size], page, page_size, has_next=len(items) > page_size)
+    items = query.limit(page_size).offset((page - 1) * page_size).all()
+    if total == 'approx':
+        return OffsetPage(items, page, page_size, count_cache.estimate(query), estimated=True)
+    return OffsetPage(items, page, page_size, count_cache.count(query))
+
+
+def encode_cursor(sort_value, row_id) -> str:
+    """
+    Opaque cursor of a row for keyset pagination
+    """
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Returns:
+        (sort_value, row_id), () for an empty cursor (first page)
+    Raises:
+        ValueError: the cursor was not made by encode_cursor
+    """
+    if not cursor:
+        return ()
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(row_id, str) or isinstance(sort_value, (list, dict)):
+        raise ValueError('Invalid cursor')
+    return sort_value, row_id
+
+
+class KeysetPage(object):
+    """
+    A page of keyset pagination, the totals are not computed
+    """
+
+    def __init__(self, items: list, next_cursor: str = None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.pages = None
+        self.total = None
@@ -0,0 +1,67 @@
+import os
+import sys
+import timeit
+
+from flask import _app_ctx_stack
+from flask_jwt_extended import create_access_token, decode_token, get_jwt_claims
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from app.app import create_app
+from app.gateway import permission_registry, get_request_claims, _has_endpoint_permission
+from app.settings import DevConfig
+
+"""
+Per-request cost of the permission check of authorization_require, JWT verification excluded.
+    before: format "method@rule" and scan the "list_permission" claim
+    after: precompiled endpoint lookup and a bit test on the decoded bitmap
+
+Run from the project root:
+    python benchmark/gateway.py
+"""
+
+NUMBER = 100000
+
+
+def legacy_check(request):
+    get_jwt_claims().get("force_change_password")
+    permission_route = "{0}@{1}".format(request.method.lower(), request.url_rule.rule)
+    return permission_route in get_jwt_claims().get("list_permission")
+
+
+def main():
+    app = create_app(DevConfig)
+    permissions = list(permission_registry.keys)
+    with app.app_context():
+        legacy_token = create_access_token(identity='benchmark', user_claims={"list_permission": permissions})
+        bitmap_token = create_access_token(identity='benchmark', user_claims={
+            "permission_bitmap": permission_registry.encode(permissions),
+            "permission_version": permission_registry.version
+        })
+    # the last route in the sorted list is the worst case of the list scan
+    with app.test_request_context('/api/v1/admin/users/roles', method='GET') as ctx:
+        endpoint, method = ctx.request.url_rule.endpoint, ctx.request.method
+
+        _app_ctx_stack.top.jwt = decode_token(legacy_token)
+        before = timeit.timeit(lambda: legacy_check(ctx.request), number=NUMBER)
+
+        top = _app_ctx_stack.top
+        top.jwt = decode_token(bitmap_token)
+
+        def check():
+            # a new request: nothing memoized yet
+            top.jwt_permissions = None
+            get_request_claims().get("force_change_password")
+            return _has_endpoint_permission(endpoint, method)
+
+        after = timeit.timeit(check, number=NUMBER)
+        memoized = timeit.timeit(lambda: _has_endpoint_permission(endpoint, method), number=NUMBER)
+
+    print("routes: {}".format(len(permissions)))
+    print("before:          {:.3f} us/request".format(before / NUMBER * 1e6))
+    print("after:           {:.3f} us/request".format(after / NUMBER * 1e6))
+    print("after, memoized: {:.3f} us/check".format(memoized / NUMBER * 1e6))
+
+
+if __name__ == '__main__':
+    main()
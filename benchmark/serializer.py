@@ -0,0 +1,82 @@
+import os
+import sys
+import timeit
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from app.app import create_app
+from app.extensions import db
+from app.models import User, TopicQuestion, Question, Comment, History
+from app.schema_validator import QuestionSchema, CommentSchema, HistorySchema, UserSchema, PrefetchSchema
+from app.settings import DevConfig
+
+"""
+Cost of dumping 1000 rows with the hot schemas, the relations already loaded.
+    marshmallow: Schema.dump, after the same prefetch
+    compiled: the generated function of app.serializer, same output
+
+Run from the project root:
+    python benchmark/serializer.py
+"""
+
+ROWS = 1000
+NUMBER = 20
+
+
+class BenchmarkConfig(DevConfig):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    DUPLICATE_INDEX_TTL = 0
+    QUESTION_COUNT_REPAIR_INTERVAL = 0
+
+
+def new_id():
+    return str(uuid.uuid4())
+
+
+def populate():
+    users = [User(id=new_id(), email='user{}@example.com'.format(i), username='user{}'.format(i),
+                  first_name='Nguyễn Văn', last_name='User {}'.format(i)) for i in range(50)]
+    # the default creator is the admin of the seed data, absent here
+    for user in users:
+        user.creator_id = users[0].id
+    topics = [TopicQuestion(id=new_id(), name='Topic {}'.format(i), creator_id=users[0].id) for i in range(10)]
+    db.session.add_all(users + topics)
+    db.session.flush()
+    for i in range(ROWS):
+        question = Question(id=new_id(), title='Question {}'.format(i),
+                            description='Description of question {}'.format(i), topic_id=topics[i % len(topics)].id,
+                            creator_id=users[i % 50].id,
+                            user_id=users[i % 50].id, assignee_user_id=users[(i + 1) % 50].id, status=i % 3,
+                            created_date=i)
+        db.session.add(question)
+        db.session.add(Comment(id=new_id(), message='Comment {}'.format(i), sender_id=users[i % 50].id,
+                               question_id=question.id, created_date=i))
+        db.session.add(History(id=new_id(), status=i % 3, creator_id=users[i % 50].id,
+                               assignee_user_id=users[(i + 1) % 50].id, question_id=question.id, created_date=i))
+    db.session.commit()
+
+
+def main():
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        populate()
+        cases = [
+            ('QuestionSchema', QuestionSchema(many=True), Question.query.all()),
+            ('CommentSchema', CommentSchema(many=True), Comment.query.all()),
+            ('HistorySchema', HistorySchema(many=True), History.query.all()),
+            ('UserSchema', UserSchema(many=True), User.query.all() * (ROWS // 50)),
+        ]
+        for name, schema, rows in cases:
+            expected = PrefetchSchema.dump(schema, rows)
+            # the first call compiles the serializer and loads the relations
+            assert schema.dump(rows) == expected, name
+            before = timeit.timeit(lambda: PrefetchSchema.dump(schema, rows), number=NUMBER)
+            after = timeit.timeit(lambda: schema.dump(rows), number=NUMBER)
+            print("{:<15} marshmallow: {:7.2f} ms  compiled: {:7.2f} ms  x{:.1f}".format(
+                name, before / NUMBER * 1e3, after / NUMBER * 1e3, before / after))
+
+
+if __name__ == '__main__':
+    main()
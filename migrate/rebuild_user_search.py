@@ -0,0 +1,35 @@
+import os
+
+from flask import Flask
+
+from app.extensions import db
+from app.models import User
+from app.settings import ProdConfig, DevConfig
+
+
+class Worker:
+    """
+    Fill User.search_name and the user_trigram table of existing users
+    """
+
+    def __init__(self):
+        print("=" * 50, "Starting rebuild user search", "=" * 50)
+        config = DevConfig if os.environ.get('FLASK_DEBUG') == '1' else ProdConfig
+
+        app = Flask(__name__)
+        app.config.from_object(config)
+        db.app = app
+        db.init_app(app)
+
+        print(f"Starting rebuild user search on the uri: {config.SQLALCHEMY_DATABASE_URI}")
+        app_context = app.app_context()
+        app_context.push()
+
+    def rebuild(self):
+        User.rebuild_search_index()
+
+
+if __name__ == '__main__':
+    worker = Worker()
+    worker.rebuild()
+    print("=" * 50, "Rebuild User Search Completed", "=" * 50)
@@ -0,0 +1,3 @@
+-- Index token lookups by jti (revocation check) and by expires (prune_database)
+ALTER TABLE token ADD INDEX ix_token_jti (jti);
+ALTER TABLE token ADD INDEX ix_token_expires (expires);
@@ -0,0 +1,2 @@
+-- Per-user token epoch used by TOKEN_REVOCATION_MODE = 'epoch'
+ALTER TABLE `user` ADD COLUMN token_epoch INT UNSIGNED NOT NULL DEFAULT 0;
@@ -0,0 +1,2 @@
+-- Full-text search on question title and description (MySQL >= 5.7.6 for the ngram parser)
+ALTER TABLE `question` ADD FULLTEXT INDEX ft_question_title_description (title, description) WITH PARSER ngram;
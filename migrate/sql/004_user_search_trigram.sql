@@ -0,0 +1,12 @@
+-- Accent-insensitive user search: folded name of the user and its trigrams
+-- Fill both with "python rebuild_user_search.py" in the migrate folder
+ALTER TABLE `user` ADD COLUMN search_name VARCHAR(400) NULL;
+
+CREATE TABLE IF NOT EXISTS `user_trigram` (
+    trigram VARCHAR(3) NOT NULL,
+    user_id VARCHAR(50) NOT NULL,
+    PRIMARY KEY (trigram, user_id),
+    INDEX ix_user_trigram_user_id (user_id),
+    CONSTRAINT fk_user_trigram_user_id FOREIGN KEY (user_id) REFERENCES `user` (id)
+        ON DELETE CASCADE ON UPDATE CASCADE
+);
@@ -0,0 +1,18 @@
+-- Composite indexes for the question lists: equality filters first, then the created_date range and sort.
+-- The composite indexes on user_id / question_id also serve their foreign keys, so the single column ones are dropped.
+ALTER TABLE `question`
+    ADD INDEX ix_question_assignee_created (assignee_user_id, created_date),
+    ADD INDEX ix_question_assignee_status_created (assignee_user_id, status, created_date),
+    ADD INDEX ix_question_status_created (status, created_date),
+    ADD INDEX ix_question_creator_created (creator_id, created_date),
+    ADD INDEX ix_question_user_created (user_id, created_date),
+    ADD INDEX ix_question_title (title),
+    DROP INDEX ix_question_user_id;
+
+ALTER TABLE `comment`
+    ADD INDEX ix_comment_question_created (question_id, created_date),
+    DROP INDEX ix_comment_question_id;
+
+ALTER TABLE `history`
+    ADD INDEX ix_history_question_created (question_id, created_date),
+    DROP INDEX ix_history_question_id;
@@ -0,0 +1,16 @@
+-- Participants (creator and user) of each question, read by "my questions" instead of creator_id OR user_id
+CREATE TABLE IF NOT EXISTS `question_participant` (
+    user_id VARCHAR(50) NOT NULL,
+    question_id VARCHAR(50) NOT NULL,
+    PRIMARY KEY (user_id, question_id),
+    INDEX ix_question_participant_question_id (question_id),
+    CONSTRAINT fk_question_participant_user_id FOREIGN KEY (user_id) REFERENCES `user` (id)
+        ON DELETE CASCADE ON UPDATE CASCADE,
+    CONSTRAINT fk_question_participant_question_id FOREIGN KEY (question_id) REFERENCES `question` (id)
+        ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+INSERT IGNORE INTO `question_participant` (user_id, question_id)
+SELECT q.creator_id, q.id FROM `question` q JOIN `user` u ON u.id = q.creator_id
+UNION
+SELECT q.user_id, q.id FROM `question` q JOIN `user` u ON u.id = q.user_id;
@@ -0,0 +1,5 @@
+-- Counter cache of the questions of a topic, kept up to date by the application
+ALTER TABLE `topic_question` ADD COLUMN question_count INT NOT NULL DEFAULT 0;
+
+UPDATE `topic_question` t
+SET t.question_count = (SELECT COUNT(*) FROM `question` q WHERE q.topic_id = t.id);
@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+from unittest import mock
+from types import SimpleNamespace
+
+from marshmallow import ValidationError
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from app.schema_validator import GetQuestionValidation, GetFieldsetValidation, QuestionSchema, get_fieldset, \
+    get_validator
+
+"""
+Run from the project root:
+    python -m unittest discover tests
+"""
+
+
+class EmptyFieldsetTest(unittest.TestCase):
+
+    def test_empty_fields_param_is_rejected(self):
+        for value in ['', ',', ' , ']:
+            for validator in (GetQuestionValidation(), GetFieldsetValidation()):
+                with self.assertRaises(ValidationError) as context:
+                    validator.load({'fields': value})
+                self.assertIn('fields', context.exception.messages)
+
+    def test_get_fieldset_rejects_empty_fieldset(self):
+        with self.assertRaises(ValidationError) as context:
+            get_fieldset(QuestionSchema, {'fieldset': ()})
+        self.assertIn('fields', context.exception.messages)
+
+    def test_get_fieldset_reuses_the_shared_schema(self):
+        get_validator(QuestionSchema)
+        with mock.patch.object(QuestionSchema, '__init__', autospec=True, side_effect=QuestionSchema.__init__) as init:
+            fieldset = get_fieldset(QuestionSchema, {'fieldset': ('id', 'topic.name'), 'include': ('creator',)})
+        self.assertIn('topic.name', fieldset)
+        self.assertIn('creator', fieldset)
+        self.assertEqual(init.call_count, 0)
+
+    def test_compiled_dump_with_empty_only(self):
+        question = SimpleNamespace(id='1', title='title')
+        self.assertEqual(QuestionSchema(only=[]).dump(question), {})
+        self.assertEqual(QuestionSchema(only=['id']).dump(question), {'id': '1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import sys
+import unittest
+
+from flask import Flask, _app_ctx_stack
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from app.gateway import get_current_principal, has_permission, permission_registry
+
+"""
+Run from the project root:
+    python -m unittest discover tests
+"""
+
+
+def verify(user_id: str, group_id: str, permissions=()):
+    """
+    What verify_jwt_in_request leaves on the app context for a token of the user
+    """
+    _app_ctx_stack.top.jwt = {'identity': user_id,
+                              permission_registry.claims_key: {'group_id': group_id,
+                                                               'list_permission': list(permissions)}}
+
+
+class SharedAppContextTest(unittest.TestCase):
+    """
+    Requests served inside an outer app context share it, and so share the JWT of flask_jwt_extended
+    """
+
+    def setUp(self):
+        self.context = Flask(__name__).app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_principal_follows_the_verified_token(self):
+        self.assertIsNone(get_current_principal())
+        verify('alice', 'staff')
+        principal = get_current_principal()
+        self.assertEqual((principal.id, principal.group_id), ('alice', 'staff'))
+        self.assertIs(get_current_principal(), principal)
+        verify('bob', 'student')
+        principal = get_current_principal()
+        self.assertEqual((principal.id, principal.group_id), ('bob', 'student'))
+
+    def test_permissions_follow_the_verified_token(self):
+        verify('alice', 'staff', ['get@/api/v1/admin/users'])
+        self.assertTrue(has_permission('get@/api/v1/admin/users'))
+        verify('bob', 'student')
+        self.assertFalse(has_permission('get@/api/v1/admin/users'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+from werkzeug.security import generate_password_hash
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from app.security import PasswordHasher
+
+"""
+Run from the project root:
+    python -m unittest discover tests
+"""
+
+
+class CheckUserPasswordTest(unittest.TestCase):
+
+    def setUp(self):
+        # without init_app the hashes are computed inline
+        self.hasher = PasswordHasher()
+        self.hasher.method = 'pbkdf2:sha256:1000'
+
+    def make_user(self, password, hashed_password):
+        password_hash = None
+        if hashed_password is not None:
+            password_hash = generate_password_hash(hashed_password, self.hasher.method, self.hasher.salt_length)
+        return SimpleNamespace(password=password, password_hash=password_hash)
+
+    def test_hash_in_sync(self):
+        user = self.make_user('current', 'current')
+        self.assertEqual(self.hasher.check_user_password(user, 'current'), (True, None))
+        self.assertEqual(self.hasher.check_user_password(user, 'other'), (False, None))
+
+    def test_hash_is_stale_plaintext_is_current(self):
+        # password reset by an admin before update_user refreshed password_hash
+        user = self.make_user('current', 'before_reset')
+        self.assertEqual(self.hasher.check_user_password(user, 'before_reset'), (False, None))
+        valid, new_hash = self.hasher.check_user_password(user, 'current')
+        self.assertTrue(valid)
+        self.assertTrue(self.hasher.verify(new_hash, 'current'))
+
+    def test_hash_missing(self):
+        user = self.make_user('current', None)
+        valid, new_hash = self.hasher.check_user_password(user, 'current')
+        self.assertTrue(valid)
+        self.assertTrue(self.hasher.verify(new_hash, 'current'))
+
+    def test_hash_only(self):
+        user = self.make_user(None, 'current')
+        self.assertEqual(self.hasher.check_user_password(user, 'current'), (True, None))
+        self.assertEqual(self.hasher.check_user_password(user, 'other'), (False, None))
+        self.hasher.method = 'pbkdf2:sha256:2000'
+        valid, new_hash = self.hasher.check_user_password(user, 'current')
+        self.assertTrue(valid)
+        self.assertTrue(new_hash.startswith('pbkdf2:sha256:2000$'))
+
+
+if __name__ == '__main__':
+    unittest.main()
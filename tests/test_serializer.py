@@ -0,0 +1,129 @@
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from app.loader import UserSummary, user_summaries
+from app.schema_validator import QuestionSchema, CommentSchema, HistorySchema, UserSchema, PrefetchSchema
+
+"""
+The generated serializers of app.serializer against marshmallow, on objects without a database.
+Run from the project root:
+    python -m unittest discover tests
+"""
+
+SUMMARIES = {
+    'u1': UserSummary('u1', 'an@example.com', 'Nguyễn Văn', 'An', '/files/avatars/default.jpg'),
+    'u2': UserSummary('u2', 'binh@example.com', 'Trần', None, None),
+}
+
+
+def load_many(ids):
+    # u3 is an unknown user, dumped as None
+    return {_id: SUMMARIES.get(_id) for _id in set(ids)}
+
+
+def make_user(_id, **values):
+    user = dict(id=_id, password='secret', password_hash='pbkdf2:sha256:1000$salt$hash', first_name='Nguyễn Văn',
+                last_name='An', email='an@example.com', username='an', status=1, avatar_url=None,
+                creator_id='u2', creator=SimpleNamespace(id='u2', email='binh@example.com'), group_id='g1',
+                group=SimpleNamespace(id='g1', name='Sinh viên'))
+    user.update(values)
+    return SimpleNamespace(**user)
+
+
+def make_question(_id, **values):
+    question = dict(id=_id, description='Kiểm tra thông tin đóng học phí', title='Xin miễn giảm học phí',
+                    created_date=1650098250, attached_file_url=None, attached_file_name='don.doc', topic_id='t1',
+                    status=0, user_id='u1', assignee_user_id='u2', creator_id='u3',
+                    topic=SimpleNamespace(id='t1', name='Học phí', description=None, creator_id='u1',
+                                          number_of_questions=4))
+    question.update(values)
+    return SimpleNamespace(**question)
+
+
+def make_comment(_id, **values):
+    comment = dict(id=_id, message='Vâng ạ', attached_file_url=None, attached_file_name=None,
+                   created_date=1650086792, sender_id='u1', question_id='q1', sender=make_user('u1'))
+    comment.update(values)
+    return SimpleNamespace(**comment)
+
+
+def make_history(_id, **values):
+    history = dict(id=_id, status=1, type=0, created_date=1650086792, creator_id='u1', assignee_user_id='u3',
+                   question_id='q1')
+    history.update(values)
+    return SimpleNamespace(**history)
+
+
+def without(obj, name: str):
+    delattr(obj, name)
+    return obj
+
+
+class CompiledDumpParityTest(unittest.TestCase):
+    """
+    CompiledSchema.dump must return what PrefetchSchema.dump, marshmallow after the same prefetch, returns
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(user_summaries, 'load_many', side_effect=load_many)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertSameDump(self, schema, obj, many: bool = None):
+        expected = PrefetchSchema.dump(schema, obj, many=many)
+        self.assertEqual(schema.dump(obj, many=many), expected)
+        return expected
+
+    def check(self, schema_class, objects, shapes):
+        for shape in shapes:
+            with self.subTest(schema=schema_class.__name__, shape=shape):
+                schema = schema_class(**shape)
+                for obj in objects:
+                    self.assertSameDump(schema, obj)
+                self.assertSameDump(schema, objects, many=True)
+                self.assertSameDump(schema_class(many=True, **shape), objects)
+
+    def test_question(self):
+        objects = [make_question('q1'), make_question('q2', topic=None, user_id=None, status=None),
+                   without(make_question('q3'), 'id'), without(make_question('q4'), 'creator_id'),
+                   make_question('q5', created_date='1650098250', status='2')]
+        self.check(QuestionSchema, objects, [{}, {'only': ['id', 'title', 'status']}, {'only': ['id', 'topic']},
+                                             {'only': ['id', 'topic.name']}, {'only': ['topic.creator', 'user']},
+                                             {'exclude': ['topic', 'creator']}])
+
+    def test_comment(self):
+        objects = [make_comment('c1'), make_comment('c2', sender=None), without(make_comment('c3'), 'id'),
+                   make_comment('c4', sender=make_user('u2', creator=None, group=None, status=None))]
+        self.check(CommentSchema, objects, [{}, {'only': ['id', 'message']}, {'only': ['id', 'sender.email']},
+                                            {'only': ['sender.creator.email', 'sender.group']}])
+
+    def test_history(self):
+        objects = [make_history('h1'), make_history('h2', creator_id=None, assignee_user_id='u2'),
+                   without(make_history('h3'), 'id'), without(make_history('h4'), 'assignee_user_id')]
+        self.check(HistorySchema, objects, [{}, {'only': ['id', 'status']}, {'only': ['creator', 'assignee_user']}])
+
+    def test_user(self):
+        objects = [make_user('u1'), make_user('u2', creator=None, group=None, creator_id=None),
+                   without(make_user('u3'), 'id'), without(make_user('u4'), 'group')]
+        self.check(UserSchema, objects, [{}, {'only': ['id', 'email']}, {'only': ['id', 'group.name']},
+                                         {'exclude': ['password', 'password_hash']}])
+
+    def test_empty_list(self):
+        for schema_class in (QuestionSchema, CommentSchema, HistorySchema, UserSchema):
+            self.assertEqual(schema_class(many=True).dump([]), [])
+
+    def test_expected_output(self):
+        # one case spelled out, the parity checks alone would pass if both sides changed
+        dumped = self.assertSameDump(QuestionSchema(only=['id', 'topic.name', 'creator', 'assignee_user']),
+                                     make_question('q1'))
+        self.assertEqual(dumped, {'id': 'q1', 'topic': {'name': 'Học phí'}, 'creator': None,
+                                  'assignee_user': SUMMARIES['u2'].to_dict()})
+
+
+if __name__ == '__main__':
+    unittest.main()